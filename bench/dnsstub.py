@@ -0,0 +1,167 @@
+#!/usr/bin/python3
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## A minimal authoritative DNS server (TCP only) for the benchmarks: It accepts
+## every update (without checking TSIG) and keeps the records in memory, answers
+## queries with them (following CNAMEs) and NS queries with no records, so
+## verifytlsa only asks this server. Prints its port once it is listening.
+
+import argparse
+import os
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sir.dns
+
+
+
+## {name: {type: (ttl, [rdata])}} with lower case names without trailing dot
+RECORDS = {}
+LOCK    = threading.Lock()
+
+
+
+def rr(name, type, ttl, rdata):
+	return sir.dns.encodeName(name) + struct.pack('!HHIH', type, sir.dns.Class.IN, ttl, len(rdata)) + rdata
+
+
+
+def update(message):
+	for change in message.authority:
+		name   = change.name.lower()
+		rrsets = RECORDS.setdefault(name, {})
+		
+		rdata = change.rdata
+		if change.type == sir.dns.Type.CNAME and change.cls != sir.dns.Class.ANY:
+			rdata = sir.dns.encodeName(message.decodeName(change)[0].lower())
+		
+		if change.cls == sir.dns.Class.ANY:
+			if change.type == 255:
+				rrsets.clear()
+			else:
+				rrsets.pop(change.type, None)
+		
+		elif change.cls == sir.dns.Class.NONE:
+			ttl, rdatas = rrsets.get(change.type, (0, []))
+			if rdata in rdatas:
+				rdatas.remove(rdata)
+			if not rdatas:
+				rrsets.pop(change.type, None)
+		
+		## Like on real servers, a CNAME can't have other records next to it and
+		## a new CNAME replaces the old one.
+		elif change.type == sir.dns.Type.CNAME:
+			if not set(rrsets) - {sir.dns.Type.CNAME}:
+				rrsets[change.type] = (change.ttl, [rdata])
+		
+		elif sir.dns.Type.CNAME not in rrsets:
+			ttl, rdatas = rrsets.get(change.type, (0, []))
+			rrsets[change.type] = (change.ttl, rdatas + [rdata] if rdata not in rdatas else rdatas)
+
+
+
+## The RRs answering a query for type at name
+def answer(name, type):
+	if type == sir.dns.Type.NS:
+		return []
+	
+	rrs = []
+	for _ in range(8):
+		rrsets = RECORDS.get(name, {})
+		if type in rrsets or sir.dns.Type.CNAME not in rrsets:
+			break
+		
+		ttl, (target,) = rrsets[sir.dns.Type.CNAME]
+		rrs.append(rr(name, sir.dns.Type.CNAME, ttl, target))
+		name = sir.dns.decodeName(target, 0)[0]
+	
+	ttl, rdatas = RECORDS.get(name, {}).get(type, (0, []))
+	return rrs + [rr(name, type, ttl, rdata) for rdata in rdatas]
+
+
+
+def respond(wire):
+	id, flags, qdCount = struct.unpack_from('!HHH', wire)
+	name, offset = sir.dns.decodeName(wire, 12)
+	type, = struct.unpack_from('!H', wire, offset)
+	question = wire[12:offset + 4]
+	
+	with LOCK:
+		if (flags >> 11) & 0xF == sir.dns.Opcode.UPDATE:
+			update(sir.dns.Message(wire))
+			rrs = []
+		else:
+			rrs = answer(name.lower(), type)
+	
+	## QR and AA, the opcode of the request
+	flags = 0x8400 | (flags & 0x7800)
+	return struct.pack('!HHHHHH', id, flags, 1, len(rrs), 0, 0) + question + b''.join(rrs)
+
+
+
+class Handler(socketserver.BaseRequestHandler):
+	def recv(self, size):
+		data = b''
+		while len(data) < size:
+			chunk = self.request.recv(size - len(data))
+			if not chunk:
+				raise EOFError()
+			data += chunk
+		
+		return data
+	
+	def handle(self):
+		try:
+			while True:
+				wire = self.recv(struct.unpack('!H', self.recv(2))[0])
+				time.sleep(self.server.latency)
+				response = respond(wire)
+				self.request.sendall(struct.pack('!H', len(response)) + response)
+		
+		except (EOFError, ConnectionError):
+			pass
+
+
+
+class Server(socketserver.ThreadingTCPServer):
+	daemon_threads      = True
+	allow_reuse_address = True
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Minimal DNS server accepting TLSA updates for the benchmarks')
+	parser.add_argument('--port',    type = int,   default = 0, help = 'Port to listen on (default: any free port)')
+	parser.add_argument('--latency', type = float, default = 0, help = 'Seconds to wait before answering each message (default: 0)')
+	args = parser.parse_args()
+	
+	with Server(('127.0.0.1', args.port), Handler) as server:
+		server.latency = args.latency
+		print(server.server_address[1], flush = True)
+		server.serve_forever()
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## Generates a synthetic config with many certs, domains and records. Like a
+## real config, it uses defaults and fallback lists: The records of every
+## domain come from defaultRecords and the zone of every domain from the
+## defaultZones of its cert (or with autoZones from the configured zones,
+## where every cert has a delegated subzone of its zone). The certs can be split
+## into fragments in the conf.d directory next to the config.
+
+import argparse
+import os
+import sys
+import yaml
+
+
+
+## The scripts and the server default to nothing being done or sent anywhere,
+## bench/steps.py points them to the stubs.
+def generate(certs = 1000, domains = 3, ports = 4, zones = 10, dir = '/tmp/sir-bench', autoZones = False, signScript = 'none', rolloverScript = 'none', server = '127.0.0.1', port = 53, ttl = 300):
+	config = {
+		'certDefaults': {
+			'signScript'     : signScript,
+			'rolloverScript' : rolloverScript,
+			'type'           : 'rsa:2048',
+			'keyDir'         : os.path.join(dir, 'keys', ''),
+			'csrDir'         : os.path.join(dir, 'csrs', ''),
+			'certDir'        : os.path.join(dir, 'certs', ''),
+			'chainDir'       : os.path.join(dir, 'chains', ''),
+		},
+		'zoneDefaults': {
+			'server' : server,
+			'port'   : port,
+		},
+		'recordDefaults': {
+			'ttl'      : ttl,
+			'usage'    : 'DANE_EE',
+			'selector' : 'SPKI',
+			'type'     : 'SHA256',
+		},
+		'defaultRecords': [{'port': 443 + i} for i in range(ports)],
+		'certs': [
+			{
+				'name'         : 'cert%d' % c,
+				'defaultZones' : [{'name': 'zone%d.example' % (c % zones)}],
+				'domains'      : [{'name': 'd%d.cert%d.zone%d.example' % (d, c, c % zones)} for d in range(domains)],
+			}
+			for c in range(certs)
+		],
+	}
+	
+	if autoZones:
+		config['defaultZones'] = 'auto'
+		config['zones'] = [{'name': 'zone%d.example' % z} for z in range(zones)] + [{'name': 'cert%d.zone%d.example' % (c, c % zones)} for c in range(certs)]
+		for cert in config['certs']:
+			del cert['defaultZones']
+	
+	return config
+
+
+
+## Writes config to fileName, with its certs split into the given number of
+## fragments
+def write(fileName, config, fragments = 0):
+	if fragments:
+		certs  = config['certs']
+		config = dict(config, certs = [])
+		
+		dir = os.path.join(os.path.dirname(fileName), 'conf.d')
+		os.makedirs(dir, exist_ok = True)
+		for i in range(fragments):
+			with open(os.path.join(dir, '%04d.yaml' % i), 'w') as f:
+				yaml.safe_dump({'certs': certs[i::fragments]}, f, default_flow_style = False)
+	
+	with open(fileName, 'w') as f:
+		yaml.safe_dump(config, f, default_flow_style = False)
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Writes a synthetic sir config')
+	parser.add_argument('--certs',   type = int, default = 1000, help = 'Number of certs (default: 1000)')
+	parser.add_argument('--domains', type = int, default = 3,    help = 'Domains per cert (default: 3)')
+	parser.add_argument('--ports',   type = int, default = 4,    help = 'Records (ports) per domain (default: 4)')
+	parser.add_argument('--zones',   type = int, default = 10,   help = 'Number of zones (default: 10)')
+	parser.add_argument('--dir',     default = '/tmp/sir-bench', help = 'Base of the key, csr, cert and chain dirs (default: /tmp/sir-bench)')
+	parser.add_argument('--auto-zones', action = 'store_true', help = 'Discover the zones of the domains (with a subzone per cert) instead of naming them')
+	parser.add_argument('--fragments', type = int, default = 0, help = 'Split the certs into this many fragments in the conf.d directory next to the output file (default: 0)')
+	parser.add_argument('--sign-script', default = 'none', help = 'signScript of every cert (default: none)')
+	parser.add_argument('--rollover-script', default = 'none', help = 'rolloverScript of every cert (default: none)')
+	parser.add_argument('--server', default = '127.0.0.1', help = 'Server of every zone (default: 127.0.0.1)')
+	parser.add_argument('--port', type = int, default = 53, help = 'Port of the server of every zone (default: 53)')
+	parser.add_argument('--ttl', type = int, default = 300, help = 'TTL of every record (default: 300)')
+	parser.add_argument('-o', '--output', help = 'Output file (default: stdout)')
+	args = parser.parse_args()
+	
+	config = generate(args.certs, args.domains, args.ports, args.zones, args.dir, args.auto_zones, args.sign_script, args.rollover_script, args.server, args.port, args.ttl)
+	
+	if args.output is None:
+		if args.fragments:
+			parser.error('--fragments needs an --output')
+		
+		sys.stdout.write(yaml.safe_dump(config, default_flow_style = False))
+	
+	else:
+		write(args.output, config, args.fragments)
+
+
+
+if __name__ == '__main__':
+	main()
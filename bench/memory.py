@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## Measures the memory and time taken by the model of a large number of TLSA
+## records. The model is built through the model API (like ConfigParser does),
+## so the yaml doesn't dominate at a million records. Reported are the bytes
+## allocated for the model (from tracemalloc), the time to build it, a full
+## garbage collection with the model alive and reading the name of every
+## record twice. Every size is measured in a fresh process. With --sir, another
+## checkout of sir can be measured, to compare versions.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+
+## One size (with the checkout, the number of records, domains per cert and
+## ports per domain as arguments), prints its results as json.
+CHILD = '''
+import gc, json, sys, time, tracemalloc
+sys.path.insert(0, sys.argv[1])
+import sir.model
+
+records, domains, ports = map(int, sys.argv[2:])
+
+def build():
+	certs     = sir.model.CertSet()
+	domainSet = sir.model.DomainSet()
+	zones     = sir.model.ZoneSet()
+	for c in range((records + domains * ports - 1) // (domains * ports)):
+		zone = zones.get('zone%d.example' % (c % 10), server = '127.0.0.1', port = 53)
+		certs.add('cert%d' % c, signScript = 'none', rolloverScript = 'none')
+		cert = certs.get('cert%d' % c)
+		for d in range(domains):
+			domain = domainSet.get('d%d.cert%d.zone%d.example' % (d, c, c % 10))
+			cert.addDomain(domain)
+			zoneDomain = zone.getZoneDomainOfDomain(domain)
+			for p in range(ports):
+				zoneDomain.getPort(443 + p).createRecord(cert, ttl = 300)
+	
+	return (certs, domainSet, zones)
+
+start = time.perf_counter()
+model = build()
+built = time.perf_counter()
+
+gc.collect()
+collected = time.perf_counter()
+
+all = [record for zone in model[2].keys() for zoneDomain in zone.zoneDomains for port in zoneDomain.ports for record in port.records]
+naming = time.perf_counter()
+for i in range(2):
+	for record in all:
+		record.name
+named = time.perf_counter()
+
+del model, all
+gc.collect()
+
+tracemalloc.start()
+model = build()
+size = tracemalloc.get_traced_memory()[0]
+
+print(json.dumps({'build': built - start, 'gc': collected - built, 'names': named - naming, 'bytes': size}))
+'''
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Measures the memory taken by the model of many TLSA records')
+	parser.add_argument('--records', type = int, nargs = '+', default = [10000, 100000, 1000000], help = 'Numbers of records (default: 10000 100000 1000000)')
+	parser.add_argument('--domains', type = int, default = 3, help = 'Domains per cert (default: 3)')
+	parser.add_argument('--ports',   type = int, default = 4, help = 'Records (ports) per domain (default: 4)')
+	parser.add_argument('--sir',     default = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'), help = 'Checkout of sir to measure (default: this one)')
+	parser.add_argument('--json',    help = 'Also write the results to this file')
+	args = parser.parse_args()
+	
+	results = {}
+	print('%10s %12s %10s %8s %8s %8s' % ('records', 'model', 'per record', 'build', 'gc', 'names'))
+	for records in args.records:
+		result = json.loads(subprocess.check_output([sys.executable, '-c', CHILD, os.path.abspath(args.sir), str(records), str(args.domains), str(args.ports)]))
+		results[records] = result
+		print('%10d %9.1f MiB %8d B %6.2f s %6.2f s %6.2f s' % (records, result['bytes'] / 2**20, result['bytes'] / records, result['build'], result['gc'], result['names']))
+	
+	if args.json is not None:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent = '\t')
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## Measures how long reading a large synthetic config takes: Loading the yaml
+## and building the model with sir.config.ConfigParser, with and without a warm
+## sir.configcache.ConfigCache. With fragments, also a run after one of them was
+## changed. Every run is done in a fresh process, so the runs don't warm up
+## each other.
+
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import genconfig
+import sir.config
+import sir.configcache
+import sir.model
+import sir.util
+
+
+
+## One run, prints the timings as json. With a cache dir, only reading the
+## config through the cache is measured.
+def child(fileName, cacheDir = None):
+	if cacheDir is not None:
+		start = time.perf_counter()
+		sir.config.ConfigParser(fileName, sir.model.CertSet(), sir.model.DomainSet(), sir.model.ZoneSet(), sir.configcache.ConfigCache(cacheDir))
+		print(json.dumps({'cached': time.perf_counter() - start}))
+		return
+	
+	start = time.perf_counter()
+	for name in [fileName] + glob.glob(os.path.join(os.path.dirname(fileName), 'conf.d', '*.yaml')):
+		sir.config.load(sir.util.readFile(name, 'rb'))
+	loaded = time.perf_counter()
+	
+	sir.config.ConfigParser(fileName, sir.model.CertSet(), sir.model.DomainSet(), sir.model.ZoneSet())
+	parsed = time.perf_counter()
+	
+	## ConfigParser loads the yaml again, so the model takes the difference
+	print(json.dumps({'yaml': loaded - start, 'model': (parsed - loaded) - (loaded - start), 'total': parsed - loaded}))
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Measures the time needed to read a large config')
+	parser.add_argument('--certs',      type = int, default = 1000, help = 'Number of certs (default: 1000)')
+	parser.add_argument('--domains',    type = int, default = 3,    help = 'Domains per cert (default: 3)')
+	parser.add_argument('--ports',      type = int, default = 4,    help = 'Records (ports) per domain (default: 4)')
+	parser.add_argument('--zones',      type = int, default = 10,   help = 'Number of zones (default: 10)')
+	parser.add_argument('--fragments',  type = int, default = 0,    help = 'Split the certs into this many fragments in conf.d (default: 0)')
+	parser.add_argument('--auto-zones', action = 'store_true',       help = 'Discover the zones of the domains (with a subzone per cert)')
+	parser.add_argument('--runs',       type = int, default = 5,    help = 'Number of runs (default: 5)')
+	parser.add_argument('--child',      help = argparse.SUPPRESS)
+	parser.add_argument('--cache',      help = argparse.SUPPRESS)
+	args = parser.parse_args()
+	
+	if args.child is not None:
+		child(args.child, args.cache)
+		return
+	
+	with tempfile.TemporaryDirectory() as dir:
+		fileName = os.path.join(dir, 'conf.yaml')
+		genconfig.write(fileName, genconfig.generate(args.certs, args.domains, args.ports, args.zones, dir, args.auto_zones), args.fragments)
+		
+		cacheDir = os.path.join(dir, 'cache')
+		command  = [sys.executable, os.path.abspath(__file__), '--child', fileName]
+		
+		runs = []
+		for i in range(args.runs):
+			runs.append(json.loads(subprocess.check_output(command)))
+		
+		## The first run with the cache fills it
+		subprocess.check_output(command + ['--cache', cacheDir])
+		for run in runs:
+			run.update(json.loads(subprocess.check_output(command + ['--cache', cacheDir])))
+		
+		if args.fragments:
+			for i, run in enumerate(runs):
+				with open(os.path.join(dir, 'conf.d', '0000.yaml'), 'a') as f:
+					f.write('# Change %d\n' % i)
+				
+				run['edited'] = json.loads(subprocess.check_output(command + ['--cache', cacheDir]))['cached']
+	
+	records = args.certs * args.domains * args.ports
+	print('%d certs, %d records, %d fragments, %d runs, %s' % (args.certs, records, args.fragments, args.runs, 'CSafeLoader' if hasattr(yaml, 'CSafeLoader') else 'SafeLoader'))
+	for key, dsc in [('yaml', 'yaml.load()'), ('model', 'Building the model'), ('total', 'ConfigParser (yaml.load() and model)'), ('cached', 'ConfigParser with a warm cache'), ('edited', 'ConfigParser after changing a fragment')]:
+		if key not in runs[0]:
+			continue
+		
+		times = [run[key] for run in runs]
+		print('%-38s min %8.3f s  median %8.3f s' % (dsc, min(times), statistics.median(times)))
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## Measures the time from starting the interpreter until sir does the first
+## action of a step (and until --help is printed). The step itself is replaced,
+## so nothing is done. The imports are taken from python -X importtime. Every
+## run is done in a fresh process, with a warm config cache and a synthetic
+## config. With --sir, another checkout of sir can be measured, to compare
+## versions.
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import genconfig
+
+
+
+STEPS = ['--help', 'key', 'cert', 'addtlsa', 'verifytlsa', 'rollover', 'updatetlsa', 'daemon', 'prunecache']
+
+IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+
+## One run of a step (with the checkout, the step and the arguments of sir as
+## arguments), prints the time of its first action and stops there. It only
+## imports what sir needs, so it doesn't distort the imports.
+CHILD = '''
+import os, sys, time
+sys.path.insert(0, sys.argv[1])
+import sir.sir
+
+def firstAction():
+	print(time.time(), flush = True)
+	os._exit(0)
+
+step = sys.argv[2]
+sys.argv = ['sir.py'] + sys.argv[3:] + [step]
+s = sir.sir.Sir()
+s._Sir__steps[step]['fn'] = firstAction
+s.main()
+'''
+
+
+
+## The sum of the top level imports and the slowest top level imports (both in
+## seconds) from the output of -X importtime
+def imports(stderr):
+	top = {}
+	for line in stderr.splitlines():
+		match = IMPORTTIME.match(line)
+		if match is not None and match.group(3) == '':
+			top[match.group(4)] = top.get(match.group(4), 0) + int(match.group(2)) / 1e6
+	
+	return (sum(top.values()), sorted(top.items(), key = lambda i: -i[1]))
+
+
+def run(sirDir, step, args):
+	if step == '--help':
+		command = [sys.executable, '-X', 'importtime', os.path.join(sirDir, 'sir.py'), '--help']
+	else:
+		command = [sys.executable, '-X', 'importtime', '-c', CHILD, sirDir, step] + args
+	
+	start = time.time()
+	process = subprocess.run(command, stdout = subprocess.PIPE, stderr = subprocess.PIPE, check = True, universal_newlines = True)
+	end = time.time()
+	
+	if step != '--help':
+		end = float(process.stdout.splitlines()[-1])
+	
+	total, top = imports(process.stderr)
+	return {'time': end - start, 'imports': total, 'top': top}
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Measures the time until sir does the first action of every step')
+	parser.add_argument('--certs',  type = int, default = 1000, help = 'Number of certs in the config (default: 1000)')
+	parser.add_argument('--runs',   type = int, default = 5,    help = 'Number of runs per step (default: 5)')
+	parser.add_argument('--steps',  default = ','.join(STEPS),  help = 'Comma separated steps to measure (default: %s)' % ','.join(STEPS))
+	parser.add_argument('--sir',    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'), help = 'Checkout of sir to measure (default: the one of this script)')
+	parser.add_argument('--top',    type = int, default = 3,    help = 'Number of the slowest imports to show per step (default: 3)')
+	parser.add_argument('--json',   help = 'Also write the results to this file, e.g. to compare versions')
+	args = parser.parse_args()
+	
+	sirDir  = os.path.abspath(args.sir)
+	results = {}
+	
+	with tempfile.TemporaryDirectory() as dir:
+		fileName = os.path.join(dir, 'conf.yaml')
+		genconfig.write(fileName, genconfig.generate(args.certs, dir = dir))
+		
+		## The config cache goes into the temporary dir, versions without it
+		## ignore the variable.
+		os.environ['XDG_CACHE_HOME'] = os.path.join(dir, 'cache')
+		sirArgs = ['-c', fileName]
+		run(sirDir, 'rollover', sirArgs)
+		
+		for step in args.steps.split(','):
+			runs = [run(sirDir, step, sirArgs) for i in range(args.runs)]
+			results[step] = {
+				'time'    : statistics.median(r['time'] for r in runs),
+				'imports' : statistics.median(r['imports'] for r in runs),
+				'top'     : runs[-1]['top'][:args.top],
+			}
+	
+	print('%s, %d certs, median of %d runs' % (sirDir, args.certs, args.runs))
+	for step, result in results.items():
+		print('%-12s %8.1f ms  imports %8.1f ms  %s' % (
+			step,
+			result['time'] * 1000,
+			result['imports'] * 1000,
+			', '.join('%s %.1f ms' % (module, t * 1000) for module, t in result['top']),
+		))
+	
+	if args.json is not None:
+		with open(args.json, 'w') as f:
+			json.dump({'sir': sirDir, 'certs': args.certs, 'runs': args.runs, 'steps': results}, f, indent = '\t')
+
+
+
+if __name__ == '__main__':
+	main()
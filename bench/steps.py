@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## Runs every step of sir (except the daemon) against a synthetic config of N
+## certs with M domains and K ports each over Z zones. The external programs
+## are replaced by the stubs in bench/stubs (openssl, the sign and rollover
+## scripts and nsupdate) with a configurable latency, the DNS server by
+## bench/dnsstub.py. Measures the time to parse the config and the time and
+## peak memory (max RSS) of every step, each in a fresh process like from cron.
+## With --sir another checkout is measured and with --json the results are
+## written to a file, so versions can be compared.
+
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import genconfig
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+
+## In the order of a rollover, so every step has something to do
+STEPS = ['key', 'cert', 'addtlsa', 'verifytlsa', 'rollover', 'updatetlsa', 'phase1', 'phase2', 'full', 'prunecache']
+
+## Steps calling the sign script, which need new certs to hand out
+SIGNING = {'cert', 'phase1', 'full'}
+
+STUBS = ['openssl', 'sign', 'rollover', 'nsupdate']
+
+
+
+## Parses the config (with the checkout, the config and the cache dir as
+## arguments), once without and once with a warm config cache (if the checkout
+## has one). Prints the timings as json.
+CHILD = '''
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+import sir.config, sir.model
+
+def parse(*cache):
+	start = time.perf_counter()
+	sir.config.ConfigParser(sys.argv[2], sir.model.CertSet(), sir.model.DomainSet(), sir.model.ZoneSet(), *cache)
+	return time.perf_counter() - start
+
+result = {'parse': parse()}
+try:
+	import sir.configcache
+except ImportError:
+	pass
+else:
+	parse(sir.configcache.ConfigCache(sys.argv[3]))
+	result['parse (cached)'] = parse(sir.configcache.ConfigCache(sys.argv[3]))
+
+result['maxrss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps(result))
+'''
+
+
+
+## Writes a new self-signed cert for every cert of the config to dir, which the
+## sign stub hands out. EC keys, as they are quick to generate.
+def issue(dir, certs):
+	now = datetime.datetime.now(datetime.timezone.utc)
+	os.makedirs(dir, exist_ok = True)
+	
+	for c in range(certs):
+		key  = ec.generate_private_key(ec.SECP256R1())
+		name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'cert%d' % c)])
+		cert = (
+			x509.CertificateBuilder()
+			.subject_name(name)
+			.issuer_name(name)
+			.public_key(key.public_key())
+			.serial_number(x509.random_serial_number())
+			.not_valid_before(now)
+			.not_valid_after(now + datetime.timedelta(days = 90))
+			.sign(key, hashes.SHA256())
+		)
+		
+		with open(os.path.join(dir, 'cert%d.pem' % c), 'wb') as f:
+			f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+
+
+## Runs one step and returns its time and max RSS (in bytes, of sir itself,
+## not of the stubs it starts)
+def step(sirDir, step, args, env):
+	start   = time.perf_counter()
+	process = subprocess.Popen([sys.executable, os.path.join(sirDir, 'sir.py')] + args + [step], stdout = subprocess.PIPE, stderr = subprocess.STDOUT, env = env)
+	output  = process.stdout.read().decode('UTF-8', 'replace')
+	
+	pid, status, usage = os.wait4(process.pid, 0)
+	end = time.perf_counter()
+	process.returncode = os.waitstatus_to_exitcode(status)
+	
+	if process.returncode != 0:
+		raise Exception('Step %s failed with %d:\n%s' % (step, process.returncode, output))
+	
+	return {'time': end - start, 'maxrss': usage.ru_maxrss * 1024}
+
+
+
+## One run of every step with a new config, new certs, an empty state and an
+## empty DNS server
+def run(sirDir, args):
+	results = {}
+	
+	with tempfile.TemporaryDirectory() as dir:
+		dns = subprocess.Popen([sys.executable, os.path.join(BENCH, 'dnsstub.py'), '--latency', str(args.dns_latency)], stdout = subprocess.PIPE, universal_newlines = True)
+		try:
+			port = int(dns.stdout.readline())
+			
+			## TTL 0 and no margin, so verifytlsa and rollover don't wait
+			config = genconfig.generate(
+				args.certs, args.domains, args.ports, args.zones, dir,
+				signScript     = os.path.join(BENCH, 'stubs', 'sign'),
+				rolloverScript = os.path.join(BENCH, 'stubs', 'rollover'),
+				port           = port,
+				ttl            = 0,
+			)
+			config['certDefaults']['keyBackend'] = args.key_backend
+			
+			fileName = os.path.join(dir, 'conf.yaml')
+			genconfig.write(fileName, config, args.fragments)
+			for sub in ('keys', 'csrs', 'certs', 'chains'):
+				os.makedirs(os.path.join(dir, sub))
+			
+			env = dict(
+				os.environ,
+				PATH            = os.path.join(BENCH, 'stubs') + os.pathsep + os.environ.get('PATH', ''),
+				XDG_CACHE_HOME  = os.path.join(dir, 'cache'),
+				SIR_BENCH_CERTS = os.path.join(dir, 'issued'),
+			)
+			for stub in STUBS:
+				env['SIR_BENCH_%s_LATENCY' % stub.upper()] = str(getattr(args, '%s_latency' % stub))
+			
+			parsed = json.loads(subprocess.check_output([sys.executable, '-c', CHILD, sirDir, fileName, os.path.join(dir, 'parsecache')]))
+			for name in ('parse', 'parse (cached)'):
+				if name in parsed:
+					results[name] = {'time': parsed[name], 'maxrss': parsed['maxrss']}
+			
+			sirArgs = [
+				'-c',              fileName,
+				'--state',         os.path.join(dir, 'state.sqlite'),
+				'--hash-cache',    os.path.join(dir, 'hashcache.sqlite'),
+				'--dns-backend',   args.dns_backend,
+				'--margin',        '0',
+				'--verify-timeout', '1m',
+			]
+			if args.diff:
+				sirArgs.append('--diff')
+			
+			for name in STEPS:
+				if name in SIGNING:
+					issue(env['SIR_BENCH_CERTS'], args.certs)
+				
+				results[name] = step(sirDir, name, sirArgs, env)
+		
+		finally:
+			dns.terminate()
+			dns.wait()
+	
+	return results
+
+
+
+def main():
+	parser = argparse.ArgumentParser(description = 'Measures the time and peak memory of every step with stubs for the external programs')
+	parser.add_argument('--certs',       type = int, default = 100, help = 'Number of certs (default: 100)')
+	parser.add_argument('--domains',     type = int, default = 3,   help = 'Domains per cert (default: 3)')
+	parser.add_argument('--ports',       type = int, default = 4,   help = 'Records (ports) per domain (default: 4)')
+	parser.add_argument('--zones',       type = int, default = 10,  help = 'Number of zones (default: 10)')
+	parser.add_argument('--fragments',   type = int, default = 0,   help = 'Split the certs into this many fragments in conf.d (default: 0)')
+	parser.add_argument('--runs',        type = int, default = 3,   help = 'Number of runs (default: 3)')
+	parser.add_argument('--dns-backend', choices = ['nsupdate', 'native'], default = 'nsupdate', help = 'DNS backend of sir (default: nsupdate, i.e. the stub)')
+	parser.add_argument('--key-backend', choices = ['openssl', 'native'],  default = 'openssl',  help = 'Key backend of the certs (default: openssl, i.e. the stub)')
+	parser.add_argument('--diff',        action = 'store_true',             help = 'Run sir with --diff')
+	parser.add_argument('--latency',     type = float, default = 0,         help = 'Latency of every stub in seconds per call (default: 0)')
+	for stub in STUBS:
+		parser.add_argument('--%s-latency' % stub, type = float, help = 'Latency of the %s stub (default: --latency)' % stub)
+	parser.add_argument('--dns-latency', type = float, default = 0,         help = 'Latency of the DNS server in seconds per message (default: 0)')
+	parser.add_argument('--sir',         default = os.path.join(BENCH, '..'), help = 'Checkout of sir to measure (default: the one of this script)')
+	parser.add_argument('--json',        help = 'Also write the results to this file, e.g. to compare versions')
+	args = parser.parse_args()
+	
+	for stub in STUBS:
+		if getattr(args, '%s_latency' % stub) is None:
+			setattr(args, '%s_latency' % stub, args.latency)
+	
+	sirDir = os.path.abspath(args.sir)
+	runs   = [run(sirDir, args) for i in range(args.runs)]
+	
+	results = {
+		name: {
+			'time'   : statistics.median(r[name]['time'] for r in runs),
+			'maxrss' : max(r[name]['maxrss'] for r in runs),
+			'times'  : [r[name]['time'] for r in runs],
+		}
+		for name in runs[0]
+	}
+	
+	print('%s, %d certs x %d domains x %d ports over %d zones (%d records), %s backend, median of %d runs' % (
+		sirDir, args.certs, args.domains, args.ports, args.zones, args.certs * args.domains * args.ports, args.dns_backend, args.runs,
+	))
+	for name, result in results.items():
+		print('%-16s %10.1f ms %8.1f MiB' % (name, result['time'] * 1000, result['maxrss'] / 2**20))
+	
+	if args.json is not None:
+		with open(args.json, 'w') as f:
+			json.dump({'sir': sirDir, 'settings': {key: value for key, value in vars(args).items() if key not in ('sir', 'json')}, 'steps': results}, f, indent = '\t')
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,119 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## Library interface: Every Run has its own model, state and options, so many
+## configs (e.g. of different tenants) can be handled in one process, also
+## concurrently from several threads. Instead of printing, the messages and
+## results of a step are returned.
+## 
+##   with sir.api.Run('/etc/sir/tenant1.yaml', state = '/var/lib/sir/tenant1.sqlite') as run:
+##       result = run.step('phase1')
+##       if result.error is not None:
+##           ...
+
+import collections
+import re
+import sir.sir
+import sir.util
+
+
+
+## The outcome of Run.step(): The StepResult of every (sub) step, the messages
+## the command line would have printed and the error (as string), which stopped
+## the step, or None.
+Result = collections.namedtuple('Result', ['step', 'steps', 'messages', 'error'])
+
+
+
+## The options are the long command line options in camelCase (e.g. signJobs
+## for --sign-jobs) with the same defaults, except for state and hashCache:
+## They are kept in memory, unless a file is given. The state is keyed by cert
+## name, so runs with different configs should never share a state file. A Run
+## has to be closed (or used as a context manager), when it isn't needed any
+## more.
+class Run:
+	def __init__(self, config, **options):
+		self.__sir    = sir.sir.Sir()
+		self.__args   = self.__sir.parser().parse_args(['prunecache'])
+		self.__loaded = False
+		
+		self.__args.config     = config
+		self.__args.state      = 'none'
+		self.__args.hash_cache = 'none'
+		
+		for key, value in options.items():
+			name = re.sub(r'[A-Z]', lambda match: '_' + match.group(0).lower(), key)
+			if name in ('config', 'step', 'verbose') or not hasattr(self.__args, name):
+				raise TypeError('Unknown option %s' % key)
+			
+			setattr(self.__args, name, 'none' if value is None and name in ('state', 'hash_cache', 'config_cache') else value)
+	
+	
+	@property
+	def config(self):
+		return self.__args.config
+	
+	
+	## Does step (see the command line) and returns its Result. The config is
+	## read by the first step, errors in it are returned as well. The steps of
+	## one Run have to be done one after another, the daemon is only available on
+	## the command line.
+	def step(self, step):
+		messages = []
+		start    = len(self.__sir.results)
+		token    = sir.util.OUTPUT.set(messages.append)
+		error    = None
+		
+		try:
+			if step == 'daemon':
+				raise Exception('The daemon can only be run from the command line')
+			
+			## A config failing half way left a part of it in the model, so it's
+			## read into a new one next time.
+			if not self.__loaded:
+				try:
+					self.__sir.load(self.__args)
+				except Exception:
+					self.__sir.close()
+					self.__sir = sir.sir.Sir()
+					raise
+				
+				self.__loaded = True
+			
+			self.__sir.step(step)
+		
+		except Exception as e:
+			error = str(e)
+		
+		finally:
+			sir.util.OUTPUT.reset(token)
+		
+		return Result(step, self.__sir.results[start:], messages, error)
+	
+	
+	## Closes the state and the hash cache. A step after it opens them again.
+	def close(self):
+		self.__sir.close()
+	
+	
+	def __enter__(self):
+		return self
+	
+	
+	def __exit__(self, *exc):
+		self.close()
@@ -16,42 +16,80 @@
 # You should have received a copy of the GNU General Public License
 # along with Sir.  If not, see <http://www.gnu.org/licenses/>.
 
-import copy
+import collections
+import concurrent.futures
+import glob
+import hashlib
+import importlib
 import logging
+import os
 import pprint
-import yaml
+import threading
+import time
+import sir.dns
+import sir.model
 import sir.util
 
 
+
+## Parses yaml with the C implementation of the parser, which is a lot faster,
+## but optional. yaml is imported on first use, since cached files don't need
+## it.
+def load(data):
+	yaml = importlib.import_module('yaml')
+	return yaml.load(data, Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+## Instead of a list of zones, a domain can have its zone discovered: auto
+## takes the most specific of the configured zones, soa asks a resolver for the
+## zone of the domain.
+AUTO_ZONES = ('auto', 'soa')
+
+
+
+## The settings of one node of the config and its ancestors. A child context
+## doesn't copy anything, every dict is a ChainMap, which looks up the keys of
+## the child first and then the ones of its parent. Updates only go into the
+## dicts of the child. Neither the yaml nor the values are modified, so they
+## can be shared with the parent.
 class Context:
 	@property
 	def position(self):
 		return '.'.join(self.__location)
 	
 	
-	def __init__(self):
-		self.__location = ['Root']
+	def __init__(self, parent = None, type = 'Root'):
+		if parent is None:
+			self.__location = (type,)
+			
+			## Parsed and validated (actual config)
+			self.root   = collections.ChainMap()
+			self.cert   = collections.ChainMap()
+			self.domain = collections.ChainMap()
+			self.zone   = collections.ChainMap()
+			self.record = collections.ChainMap()
+			
+			## Just fallback yaml
+			self.fallback = collections.ChainMap({
+				'defaultCerts'   : [],
+				'defaultDomains' : [],
+				'defaultZones'   : [],
+				'defaultRecords' : [],
+			})
 		
-		## Parsed and validated (actual config)
-		self.root   = {}
-		self.cert   = {}
-		self.domain = {}
-		self.zone   = {}
-		self.record = {}
-		
-		## Just fallback yaml
-		self.fallback = {
-			'defaultCerts'   : [],
-			'defaultDomains' : [],
-			'defaultZones'   : [],
-			'defaultRecords' : [],
-		}
+		else:
+			self.__location = parent.__location + (type,)
+			
+			self.root     = parent.root.new_child()
+			self.cert     = parent.cert.new_child()
+			self.domain   = parent.domain.new_child()
+			self.zone     = parent.zone.new_child()
+			self.record   = parent.record.new_child()
+			self.fallback = parent.fallback.new_child()
 	
 	
 	def enter(self, type):
-		new = copy.deepcopy(self)
-		new.__location.append(type)
-		return new
+		return Context(self, type)
 	
 	
 	def updateFallback(self, key, y):
@@ -60,6 +98,8 @@ class Context:
 				self.fallback[key] = []
 			elif isinstance(y[key], list):
 				self.fallback[key] = y[key]
+			elif key == 'defaultZones' and y[key] in AUTO_ZONES:
+				self.fallback[key] = y[key]
 			else:
 				raise Exception('%s @ %s is not a (empty) List' % (key, self.position))
 	
@@ -72,7 +112,7 @@ class Context:
 	## It would also lead to the pollution of the template object's parameter
 	## namespace, which is later passed directly to the object constructor.
 	def updateCert(self, y):
-		for key in ['name', 'signScript', 'rolloverScript', 'type', 'extraConf', 'keyDir', 'csrDir', 'certDir', 'chainDir']:
+		for key in ['name', 'signScript', 'rolloverScript', 'type', 'extraConf', 'keyBackend', 'signConcurrency', 'signRate', 'renewBefore', 'keyDir', 'csrDir', 'certDir', 'chainDir']:
 			if key in y:
 				self.cert[key] = y[key]
 	
@@ -90,7 +130,7 @@ class Context:
 	
 	
 	def updateRecord(self, y):
-		for key in ['port', 'ttl']:
+		for key in ['port', 'ttl', 'cname']:
 			if key in y:
 				self.record[key] = y[key]
 		
@@ -105,27 +145,22 @@ class Context:
 
 
 
-class ConfigParser:
+## Turns the yaml of one config file into a list of operations building its
+## part of the model (see ConfigParser), which don't depend on the yaml any
+## more. The settings of the root of the file end up in the given context.
+class Compiler:
 	@property
-	def rolloverScript(self):
-		return self.__rolloverScript
-	
-	
-	@property
-	def signScript(self):
-		return self.__signScript
+	def ops(self):
+		return self.__ops
 	
 	
+	def __init__(self, c, y):
+		self.__ops = []
+		self.__parseRoot(c, y or {})
 	
-	def __init__(self, fileName, certs, domains, zones):
-		self.__certs   = certs
-		self.__domains = domains
-		self.__zones   = zones
-		
-		self.__rolloverScript = None
-		
-		self.__parseRoot(Context(), yaml.load(sir.util.readFile(fileName)))
 	
+	def __emit(self, op, *args):
+		self.__ops.append((op,) + args)
 	
 	
 	
@@ -152,7 +187,10 @@ class ConfigParser:
 			c.updateFallback(key, y)
 		
 		## Do domething
-		pass
+		for zone in sir.util.noNone(y.get('zones'), []):
+			zoneContext = c.enter('Zone')
+			zoneContext.updateZone(zone)
+			self.__emit('zone', dict(zoneContext.zone))
 		
 		## Visit children
 		for cert in (y['certs'] if 'certs' in y else c.fallback['defaultCerts']):
@@ -180,7 +218,7 @@ class ConfigParser:
 			c.updateFallback(key, y)
 		
 		## Do domething
-		self.__certs.add(**c.cert)
+		self.__emit('cert', dict(c.cert))
 		
 		## Visit children
 		for domain in (y['domains'] if 'domains' in y else c.fallback['defaultDomains']):
@@ -207,11 +245,17 @@ class ConfigParser:
 			c.updateFallback(key, y)
 		
 		## Do domething
-		self.__certs.get(c.cert['name']).addDomain(self.__domains.get(c.domain['name']))
+		self.__emit('domain', c.cert['name'], c.domain['name'])
 		
 		## Visit children
-		for zone in (y['zones'] if 'zones' in y else c.fallback['defaultZones']):
-			self.__parseZone(c.enter('Zone'), zone)
+		zones = y['zones'] if 'zones' in y else c.fallback['defaultZones']
+		if zones in AUTO_ZONES:
+			for record in c.fallback['defaultRecords']:
+				self.__parseRecord(c.enter('Record'), record, zones)
+		
+		else:
+			for zone in zones:
+				self.__parseZone(c.enter('Zone'), zone)
 	
 	
 	
@@ -238,7 +282,8 @@ class ConfigParser:
 	
 	
 	
-	def __parseRecord(self, c, y):
+	## auto is one of AUTO_ZONES, if the zone still has to be discovered
+	def __parseRecord(self, c, y, auto = None):
 		## Update current element
 		c.updateRecord(y)
 		
@@ -249,13 +294,205 @@ class ConfigParser:
 		pass
 		
 		## Do domething
-		logging.debug('New record from config:\ncert: %s\ndomain: %s\nzone: %s\n record: %s', pprint.pformat(c.cert), pprint.pformat(c.domain), pprint.pformat(c.zone), pprint.pformat(c.record))
+		if logging.root.isEnabledFor(logging.DEBUG):
+			logging.debug('New record from config:\ncert: %s\ndomain: %s\nzone: %s\n record: %s', pprint.pformat(dict(c.cert)), pprint.pformat(dict(c.domain)), pprint.pformat(dict(c.zone)), pprint.pformat(dict(c.record)))
 		
-		zone = self.__zones.get(**c.zone)
-		zoneDomain = zone.getZoneDomainOfDomain(self.__domains.get(c.domain['name']))
-		port = zoneDomain.getPort(c.record['port'])
-		c.record.pop('port', None)
-		port.createRecord(self.__certs.get(c.cert['name']), **c.record)
+		## The port is not an argument of the record (and popping it from the
+		## ChainMap would only remove it from the innermost dict).
+		record = dict(c.record)
+		port   = record.pop('port')
+		
+		if auto is None:
+			self.__emit('record', dict(c.zone), c.domain['name'], port, c.cert['name'], record)
+		else:
+			self.__emit('autoRecord', auto, dict(c.zone), c.domain['name'], port, c.cert['name'], record)
 		
 		## Visit children
 		pass
+
+
+
+## Compiles the content of a config file in the context c. The errors name the
+## file, since fragments are compiled in other processes.
+def compileFile(fileName, c, data):
+	try:
+		return Compiler(c, load(data)).ops
+	
+	except Exception as e:
+		raise Exception('%s: %s' % (fileName, e))
+
+
+
+## Reads a config into the certs, domains and zones sets. Every *.yaml file in
+## the conf.d directory next to the config is a fragment of it, which inherits
+## everything from the root of the config (certDefaults, defaultZones, ...).
+## 
+## The files are compiled (see Compiler) one by one, fragments in parallel
+## processes, and then applied to the sets in the order of their names. If a
+## cache (see sir.configcache) is given, the operations of every file are
+## stored and used as long as the file doesn't change. Since fragments inherit
+## from the root, their entries are also invalidated by changes of the root.
+## 
+## Records of domains with a discovered zone (see AUTO_ZONES) are created after
+## all files were applied, so every configured zone is known by then. resolver
+## is the (server, port) asked for the zones of soa domains (default: the one
+## of /etc/resolv.conf).
+class ConfigParser:
+	@property
+	def rolloverScript(self):
+		return self.__rolloverScript
+	
+	
+	@property
+	def signScript(self):
+		return self.__signScript
+	
+	
+	
+	def __init__(self, fileName, certs, domains, zones, cache = None, jobs = None, resolver = None):
+		self.__fileName    = fileName
+		self.__certs       = certs
+		self.__domains     = domains
+		self.__zones       = zones
+		self.__cache       = cache
+		self.__resolver    = resolver
+		self.__origins     = {}
+		self.__autoRecords = []
+		
+		self.__rolloverScript = None
+		
+		## The root (and the context of its root to compile the fragments in)
+		data   = sir.util.readFile(fileName, 'rb')
+		digest = hashlib.sha256(data).hexdigest()
+		root   = self.__get(fileName, digest)
+		
+		if root is None:
+			c = Context()
+			root = (compileFile(fileName, c, data), c)
+			self.__put(fileName, digest, root)
+		
+		ops, c = root
+		self.__apply(fileName, ops)
+		
+		## The fragments
+		fragments = {}
+		missing   = []
+		for fragment in sorted(glob.glob(os.path.join(os.path.dirname(fileName), 'conf.d', '*.yaml'))):
+			data           = sir.util.readFile(fragment, 'rb')
+			fragmentDigest = hashlib.sha256(digest.encode('ascii') + data).hexdigest()
+			
+			fragments[fragment] = self.__get(fragment, fragmentDigest)
+			if fragments[fragment] is None:
+				missing.append((fragment, fragmentDigest, data))
+		
+		## Starting processes only pays off for more than one fragment. Forking
+		## while other threads run (e.g. concurrent runs of sir.api) can deadlock
+		## the children, so the fragments are compiled right here then.
+		if len(missing) > 1 and threading.active_count() == 1:
+			with concurrent.futures.ProcessPoolExecutor(max_workers = min(len(missing), jobs or os.cpu_count() or 1)) as pool:
+				futures  = [pool.submit(compileFile, fragment, c.enter('Fragment'), data) for fragment, fragmentDigest, data in missing]
+				compiled = [future.result() for future in futures]
+		
+		else:
+			compiled = [compileFile(fragment, c.enter('Fragment'), data) for fragment, fragmentDigest, data in missing]
+		
+		for (fragment, fragmentDigest, data), ops in zip(missing, compiled):
+			fragments[fragment] = ops
+			self.__put(fragment, fragmentDigest, ops)
+		
+		for fragment, ops in fragments.items():
+			self.__apply(fragment, ops)
+		
+		self.__applyAutoRecords()
+	
+	
+	def __get(self, fileName, digest):
+		return self.__cache.get(fileName, digest) if self.__cache is not None else None
+	
+	
+	def __put(self, fileName, digest, value):
+		if self.__cache is not None:
+			self.__cache.put(fileName, digest, value)
+	
+	
+	## Applies the operations of a file to the model
+	def __apply(self, fileName, ops):
+		for op, *args in ops:
+			if op == 'cert':
+				kwargs, = args
+				if kwargs['name'] in self.__origins:
+					raise Exception('Cert %s of %s already created by %s' % (kwargs['name'], fileName, self.__origins[kwargs['name']]))
+				
+				self.__origins[kwargs['name']] = fileName
+				self.__certs.add(**kwargs)
+			
+			elif op == 'domain':
+				cert, domain = args
+				self.__certs.get(cert).addDomain(self.__domains.get(domain))
+			
+			elif op == 'zone':
+				kwargs, = args
+				self.__zones.get(**kwargs)
+			
+			elif op == 'record':
+				zone, domain, port, cert, kwargs = args
+				zoneDomain = self.__zones.get(**zone).getZoneDomainOfDomain(self.__domains.get(domain))
+				zoneDomain.getPort(port).createRecord(self.__certs.get(cert), **kwargs)
+			
+			elif op == 'autoRecord':
+				self.__autoRecords.append((fileName, args))
+			
+			else:
+				raise Exception('Unknown config operation %s' % op)
+	
+	
+	## auto takes the most specific configured zone (all zones with its name),
+	## soa the zone named by the resolver with the zone settings (zoneDefaults)
+	## of the domain.
+	def __applyAutoRecords(self):
+		soa = self.__soaZones({domain for fileName, (auto, zone, domain, port, cert, kwargs) in self.__autoRecords if auto == 'soa'})
+		
+		for fileName, (auto, zone, domain, port, cert, kwargs) in self.__autoRecords:
+			domain = self.__domains.get(domain)
+			
+			if auto == 'auto':
+				zones = self.__zones.zonesOf(domain)
+				if not zones:
+					raise Exception('%s: None of the configured zones contains %s' % (fileName, domain.name))
+			
+			else:
+				zones = [self.__zones.get(**dict(zone, name = soa[domain.name]))]
+			
+			for zone in zones:
+				zone.getZoneDomainOfDomain(domain).getPort(port).createRecord(self.__certs.get(cert), **kwargs)
+	
+	
+	## The zones of the names (as {name: zone}) according to the resolver. The
+	## answers are kept in the cache (if there is one) for the TTL of their SOA
+	## record.
+	def __soaZones(self, names):
+		if not names:
+			return {}
+		
+		key     = self.__fileName + '#soa'
+		now     = time.time()
+		cached  = sir.util.noNone(self.__get(key, 'soa'), {})
+		zones   = {name: zone for name, (zone, expires) in cached.items() if expires > now}
+		missing = sorted(names - zones.keys())
+		
+		if missing:
+			resolver = sir.util.noNone(self.__resolver, (sir.dns.resolver(), 53))
+			try:
+				with sir.dns.Connection(*resolver) as dns:
+					found = dns.zones(missing)
+			
+			except OSError as e:
+				raise Exception('Can\'t ask %s port %s for the zones of domains: %s' % (resolver + (e,)))
+			
+			for name, (zone, ttl) in found.items():
+				zones[name]  = zone
+				cached[name] = (zone, now + ttl)
+			
+			self.__put(key, 'soa', {name: entry for name, entry in cached.items() if entry[1] > now})
+		
+		return zones
@@ -0,0 +1,93 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import sir.util
+
+
+
+## The compiled form of config files (see sir.config.Compiler). There is one
+## cache file per config file, which is only used, if the digest given by the
+## parser (of the content of the file and everything it depends on) and the
+## format version still match. Every user has a cache of its own, since the
+## files are pickled.
+class ConfigCache:
+	## Has to be increased, whenever the recorded operations change
+	@sir.util.classproperty
+	def FORMAT():
+		return 3
+	
+	@sir.util.classproperty
+	def DEFAULT_DIR():
+		return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'sir')
+	
+	@property
+	def dir(self):
+		return self.__dir
+	
+	def __init__(self, dir = DEFAULT_DIR()):
+		self.__dir = dir
+	
+	
+	def __path(self, fileName):
+		return os.path.join(self.__dir, 'config-%s.pickle' % hashlib.sha256(os.path.abspath(fileName).encode('UTF-8')).hexdigest())
+	
+	
+	## The value stored for the config file with the given digest or None
+	def get(self, fileName, digest):
+		try:
+			with open(self.__path(fileName), 'rb') as f:
+				format, cachedDigest, value = pickle.load(f)
+		
+		except FileNotFoundError:
+			return None
+		
+		except Exception as e:
+			logging.info('Ignoring broken config cache of %s: %s', fileName, e)
+			return None
+		
+		if format != ConfigCache.FORMAT or cachedDigest != digest:
+			return None
+		
+		logging.info('Using cached config %s', fileName)
+		return value
+	
+	
+	## The file is replaced atomically, so concurrent runs never read half of it.
+	## System users without a home can't have the default dir, which isn't worth
+	## a warning (in every cron mail), unlike a dir given explicitly.
+	def put(self, fileName, digest, value):
+		try:
+			os.makedirs(self.__dir, 0o700, exist_ok = True)
+			fd, tmp = tempfile.mkstemp(dir = self.__dir, prefix = '.config-')
+			try:
+				with open(fd, 'wb') as f:
+					pickle.dump((ConfigCache.FORMAT, digest, value), f, pickle.HIGHEST_PROTOCOL)
+				os.replace(tmp, self.__path(fileName))
+			
+			except BaseException:
+				sir.util.rmFile(tmp)
+				raise
+		
+		except OSError as e:
+			level = logging.DEBUG if self.__dir == ConfigCache.DEFAULT_DIR else logging.WARNING
+			logging.log(level, 'Can\'t write config cache of %s to %s: %s', fileName, self.__dir, e)
@@ -0,0 +1,184 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import contextlib
+import datetime
+import logging
+import signal
+import time
+import sir.state
+import sir.util
+import sir.verify
+
+
+
+## Replaces the cron jobs of both phases. Every cert has its own schedule: The
+## key step starts, when the cert expires within its renewBefore, and the
+## rollover is done as soon as verifytlsa found it to be safe. Certs due at the
+## same time are handled together, so their TLSA updates are still sent in one
+## batch.
+## 
+## runStep(step, certs) does one step for the certs. The steps are run in a
+## worker thread, so the event loop stays responsive to signals.
+class Daemon:
+	## Delay until a failed step of a cert is tried again
+	@sir.util.classproperty
+	def DEFAULT_RETRY():
+		return '5m'
+	
+	## Delay until the servers are checked again for missing TLSA records
+	@sir.util.classproperty
+	def VERIFY_RETRY():
+		return sir.verify.POLL_INTERVAL
+	
+	## The schedule is checked at least this often, e.g. in case a cert file
+	## was replaced from outside.
+	@sir.util.classproperty
+	def MAX_SLEEP():
+		return 3600
+	
+	def __init__(self, certs, state, runStep, retry = DEFAULT_RETRY()):
+		self.__certs   = list(certs)
+		self.__state   = state
+		self.__runStep = runStep
+		self.__retry   = sir.util.parseDuration(retry).total_seconds()
+		self.__retryAt = {}
+	
+	
+	## Time (as timestamp) of the next step of cert or None, if there is nothing
+	## to do. Without a renewBefore, a cert would be renewed again right after
+	## each rollover, so its rollovers are never started by the daemon.
+	def __next(self, cert, now):
+		rolloverAt = cert.rolloverAt(self.__state)
+		
+		if any(cert.isDue(step, self.__state) for step in ('cert', 'addtlsa', 'verifytlsa', 'updatetlsa')):
+			at = now
+		
+		elif rolloverAt is not None:
+			at = rolloverAt
+		
+		elif cert.renewBefore is None:
+			return None
+		
+		elif cert.isDue('key', self.__state, datetime.datetime.fromtimestamp(now, datetime.timezone.utc)):
+			at = now
+		
+		else:
+			notAfter = cert.notAfter
+			at = now if notAfter is None else (notAfter - cert.renewBefore).timestamp()
+		
+		return max(at, self.__retryAt.get(cert, 0))
+	
+	
+	## Like __next(), but a cert, whose files can't be read (e.g. a truncated
+	## cert), is planned to be tried again later instead of stopping the daemon
+	## for every other cert.
+	def __plan(self, cert, now):
+		try:
+			return self.__next(cert, now)
+		
+		except Exception as e:
+			logging.error('Can\'t plan the next step of %s: %s', cert, e)
+			if self.__retryAt.get(cert, 0) <= now:
+				self.__retryAt[cert] = now + self.__retry
+			
+			return self.__retryAt[cert]
+	
+	
+	## Whether step is due for cert. A cert, for which this can't be told, is
+	## added to broken.
+	def __isDue(self, cert, step, broken):
+		try:
+			return cert.isDue(step, self.__state)
+		
+		except Exception as e:
+			logging.error('Can\'t tell, whether step %s is due for %s: %s', step, cert, e)
+			broken.add(cert)
+			return False
+	
+	
+	## Does every step for the certs, which it is due for. A failed step doesn't
+	## stop the following ones.
+	async def __work(self, certs, now):
+		tried  = []
+		broken = set()
+		
+		for step in sir.state.STEPS:
+			due = [cert for cert in certs if cert not in broken and self.__isDue(cert, step, broken)]
+			
+			if step == 'key':
+				due = [cert for cert in due if cert.renewBefore is not None]
+			
+			if due:
+				tried.extend((cert, step) for cert in due)
+				try:
+					await asyncio.to_thread(self.__runStep, step, due)
+				except Exception as e:
+					logging.error('Step %s failed: %s', step, e)
+		
+		## Certs, which are still due for a step tried here, failed in it. They
+		## are tried again later, like the broken ones.
+		failed = {}
+		for cert, step in tried:
+			if cert not in broken and self.__isDue(cert, step, broken):
+				failed[cert] = max(failed.get(cert, 0), Daemon.VERIFY_RETRY if step == 'verifytlsa' else self.__retry)
+		
+		for cert in broken:
+			failed[cert] = self.__retry
+		
+		for cert in certs:
+			if cert in failed:
+				self.__retryAt[cert] = now + failed[cert]
+			else:
+				self.__retryAt.pop(cert, None)
+	
+	
+	async def __main(self):
+		stop = asyncio.Event()
+		loop = asyncio.get_running_loop()
+		for sig in (signal.SIGINT, signal.SIGTERM):
+			loop.add_signal_handler(sig, stop.set)
+		
+		without = sorted(cert.name for cert in self.__certs if cert.renewBefore is None)
+		if without:
+			logging.warning('Certs without renewBefore are never renewed by the daemon: %s', ', '.join(without))
+		
+		while not stop.is_set():
+			now  = time.time()
+			plan = {cert: self.__plan(cert, now) for cert in self.__certs}
+			due  = [cert for cert, at in plan.items() if at is not None and at <= now]
+			
+			if due:
+				await self.__work(due, now)
+				continue
+			
+			planned = [(at, cert) for cert, at in plan.items() if at is not None]
+			if planned:
+				at, cert = min(planned, key = lambda p: p[0])
+				logging.info('Next step for %s at %s', cert, datetime.datetime.fromtimestamp(at).isoformat(' ', 'seconds'))
+			
+			wakeup = min([at for at, cert in planned] + [now + Daemon.MAX_SLEEP])
+			with contextlib.suppress(asyncio.TimeoutError):
+				await asyncio.wait_for(stop.wait(), wakeup - now)
+		
+		logging.info('Stopped')
+	
+	
+	def run(self):
+		asyncio.run(self.__main())
@@ -0,0 +1,592 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## Just enough DNS to send TSIG signed RFC 2136 updates (and to read the
+## answers) without the nsupdate binary.
+
+import base64
+import binascii
+import collections
+import contextlib
+import enum
+import hashlib
+import hmac
+import logging
+import os
+import re
+import socket
+import struct
+import time
+import sir.util
+
+
+
+class Type(enum.IntEnum):
+	A     = 1
+	NS    = 2
+	CNAME = 5
+	SOA   = 6
+	AAAA  = 28
+	TLSA  = 52
+	TSIG  = 250
+	AXFR  = 252
+
+
+
+class Class(enum.IntEnum):
+	IN   = 1
+	NONE = 254
+	ANY  = 255
+
+
+
+class Opcode(enum.IntEnum):
+	QUERY  = 0
+	UPDATE = 5
+
+
+
+class Rcode(enum.IntEnum):
+	NOERROR  = 0
+	FORMERR  = 1
+	SERVFAIL = 2
+	NXDOMAIN = 3
+	NOTIMP   = 4
+	REFUSED  = 5
+	YXDOMAIN = 6
+	YXRRSET  = 7
+	NXRRSET  = 8
+	NOTAUTH  = 9
+	NOTZONE  = 10
+	BADSIG   = 16
+	BADKEY   = 17
+	BADTIME  = 18
+
+
+
+def encodeName(name):
+	wire = b''
+	for label in name.rstrip('.').split('.'):
+		if label == '':
+			continue
+		
+		label = label.encode('ascii')
+		if len(label) > 63:
+			raise Exception('Label %s of %s is too long' % (label, name))
+		
+		wire += struct.pack('!B', len(label)) + label
+	
+	return wire + b'\0'
+
+
+
+## Returns the (possibly compressed) name at offset and the offset right after
+## it.
+def decodeName(wire, offset):
+	labels = []
+	end    = None
+	
+	for _ in range(128):
+		length = wire[offset]
+		
+		if length & 0xC0 == 0xC0:
+			if end is None:
+				end = offset + 2
+			offset = struct.unpack_from('!H', wire, offset)[0] & 0x3FFF
+		
+		elif length == 0:
+			return ('.'.join(labels), offset + 1 if end is None else end)
+		
+		else:
+			labels.append(wire[offset + 1:offset + 1 + length].decode('ascii'))
+			offset += 1 + length
+	
+	raise Exception('Compression loop in DNS name')
+
+
+
+class Tlsa(collections.namedtuple('Tlsa', ['usage', 'selector', 'type', 'data'])):
+	TYPE = Type.TLSA
+	
+	
+	@property
+	def wire(self):
+		return struct.pack('!BBB', self.usage, self.selector, self.type) + binascii.unhexlify(self.data)
+	
+	
+	@classmethod
+	def fromWire(cls, wire):
+		return cls(wire[0], wire[1], wire[2], binascii.b2a_hex(wire[3:]).decode('ascii'))
+	
+	
+	def __str__(self):
+		return '%d %d %d %s' % self
+
+
+
+class Cname(collections.namedtuple('Cname', ['target'])):
+	TYPE = Type.CNAME
+	
+	
+	@property
+	def wire(self):
+		return encodeName(self.target)
+	
+	
+	def __str__(self):
+		return '%s.' % self.target.rstrip('.')
+
+
+
+## One line of an update: add or delete a single record (rdata) or delete a
+## whole RRset (deleteAll).
+class Change:
+	@property
+	def action(self):
+		return self.__action
+	
+	@property
+	def name(self):
+		return self.__name
+	
+	@property
+	def type(self):
+		return self.__type
+	
+	@property
+	def ttl(self):
+		return self.__ttl
+	
+	@property
+	def rdata(self):
+		return self.__rdata
+	
+	@property
+	def wire(self):
+		if self.__action == 'add':
+			cls, ttl, rdata = Class.IN, self.__ttl, self.__rdata.wire
+		
+		elif self.__action == 'delete':
+			cls, ttl, rdata = Class.NONE, 0, self.__rdata.wire
+		
+		elif self.__action == 'deleteAll':
+			cls, ttl, rdata = Class.ANY, 0, b''
+		
+		else:
+			raise Exception('Unknown update action %s' % self.__action)
+		
+		return encodeName(self.__name) + struct.pack('!HHIH', self.__type, cls, ttl, len(rdata)) + rdata
+	
+	def __init__(self, action, name, type, ttl = 0, rdata = None):
+		self.__action = action
+		self.__name   = name
+		self.__type   = type
+		self.__ttl    = ttl
+		self.__rdata  = rdata
+	
+	## As understood by nsupdate
+	def __str__(self):
+		if self.__action == 'add':
+			return 'update add %s %s %s %s' % (self.__name, self.__ttl, self.__type.name, self.__rdata)
+		
+		elif self.__action == 'delete':
+			return 'update delete %s %s %s %s' % (self.__name, self.__ttl, self.__type.name, self.__rdata)
+		
+		else:
+			return 'update delete %s %s' % (self.__name, self.__type.name)
+
+
+
+Rr = collections.namedtuple('Rr', ['name', 'type', 'cls', 'ttl', 'rdata', 'offset', 'rdataOffset'])
+
+
+
+class Message:
+	@property
+	def id(self):
+		return self.__id
+	
+	@property
+	def rcode(self):
+		return self.__flags & 0xF
+	
+	@property
+	def wire(self):
+		return self.__wire
+	
+	@property
+	def answer(self):
+		return self.__sections[0]
+	
+	@property
+	def authority(self):
+		return self.__sections[1]
+	
+	@property
+	def additional(self):
+		return self.__sections[2]
+	
+	def __init__(self, wire):
+		self.__wire = wire
+		self.__id, self.__flags, qdCount, *counts = struct.unpack_from('!HHHHHH', wire)
+		
+		offset = 12
+		for _ in range(qdCount):
+			offset = decodeName(wire, offset)[1] + 4
+		
+		self.__sections = []
+		for count in counts:
+			section = []
+			for _ in range(count):
+				start = offset
+				name, offset = decodeName(wire, offset)
+				type, cls, ttl, length = struct.unpack_from('!HHIH', wire, offset)
+				offset += 10
+				section.append(Rr(name, type, cls, ttl, wire[offset:offset + length], start, offset))
+				offset += length
+			
+			self.__sections.append(section)
+	
+	## The RRs of an answer with the given name and type
+	def rrset(self, name, type):
+		name = name.rstrip('.').lower()
+		return [rr for rr in self.answer if rr.type == type and rr.name.lower() == name]
+	
+	## Decodes a name inside of the rdata of rr (the name might be compressed).
+	def decodeName(self, rr, offset = 0):
+		return decodeName(self.__wire, rr.rdataOffset + offset)
+
+
+
+class Key:
+	FUDGE = 300
+	
+	## Name used in the TSIG RR, digest
+	ALGORITHMS = {
+		'hmac-md5'    : ('hmac-md5.sig-alg.reg.int', hashlib.md5),
+		'hmac-sha1'   : ('hmac-sha1'               , hashlib.sha1),
+		'hmac-sha224' : ('hmac-sha224'             , hashlib.sha224),
+		'hmac-sha256' : ('hmac-sha256'             , hashlib.sha256),
+		'hmac-sha384' : ('hmac-sha384'             , hashlib.sha384),
+		'hmac-sha512' : ('hmac-sha512'             , hashlib.sha512),
+	}
+	
+	## DNSSEC algorithm numbers, as used by `dnssec-keygen -a HMAC-...` files
+	NUMBERS = {
+		157 : 'hmac-md5',
+		161 : 'hmac-sha1',
+		162 : 'hmac-sha224',
+		163 : 'hmac-sha256',
+		164 : 'hmac-sha384',
+		165 : 'hmac-sha512',
+	}
+	
+	@property
+	def name(self):
+		return self.__name
+	
+	def __init__(self, name, algorithm, secret):
+		algorithm = algorithm.lower().rstrip('.')
+		if algorithm == 'hmac-md5.sig-alg.reg.int':
+			algorithm = 'hmac-md5'
+		
+		if algorithm not in Key.ALGORITHMS:
+			raise Exception('Unsupported TSIG algorithm %s' % algorithm)
+		
+		self.__name                    = name.lower().rstrip('.')
+		self.__algorithm, self.__digest = Key.ALGORITHMS[algorithm]
+		self.__secret                  = base64.b64decode(secret)
+	
+	
+	## Reads the same key files as `nsupdate -k`: A key statement (e.g. from
+	## tsig-keygen) or a K{name}.+{alg}+{id}.key/.private pair.
+	@classmethod
+	def fromFile(cls, fileName):
+		content = sir.util.readFile(fileName)
+		
+		match = re.search(r'key\s+"?([^"\s{]+)"?\s*\{(.*?)\}\s*;', content, re.S)
+		if match:
+			algorithm = re.search(r'algorithm\s+"?([\w.-]+)"?\s*;', match.group(2))
+			secret    = re.search(r'secret\s+"([^"]+)"\s*;', match.group(2))
+			if algorithm is None or secret is None:
+				raise Exception('Key %s in %s has no algorithm or secret' % (match.group(1), fileName))
+			
+			return cls(match.group(1), algorithm.group(1), secret.group(1))
+		
+		match = re.match(r'K(.+)\.\+(\d+)\+\d+\.(private|key)$', os.path.basename(fileName))
+		if match:
+			algorithm = Key.NUMBERS.get(int(match.group(2)), match.group(2))
+			
+			if match.group(3) == 'private':
+				secret = re.search(r'^Key:\s*(\S+)', content, re.M).group(1)
+			else:
+				tokens = content.split()
+				secret = ''.join(tokens[tokens.index('KEY') + 4:])
+			
+			return cls(match.group(1), algorithm, secret)
+		
+		raise Exception('Can\'t read TSIG key from %s' % fileName)
+	
+	
+	def __variables(self, timeSigned, error = 0, other = b''):
+		return (
+			encodeName(self.__name) + struct.pack('!HI', Class.ANY, 0) +
+			encodeName(self.__algorithm) +
+			struct.pack('!HIHHH', timeSigned >> 32, timeSigned & 0xFFFFFFFF, Key.FUDGE, error, len(other)) + other
+		)
+	
+	
+	def __mac(self, data):
+		return hmac.new(self.__secret, data, self.__digest).digest()
+	
+	
+	## Returns the signed message and the MAC, which is needed to verify the
+	## response.
+	def sign(self, wire):
+		timeSigned = int(time.time())
+		mac = self.__mac(wire + self.__variables(timeSigned))
+		
+		rdata = (
+			encodeName(self.__algorithm) +
+			struct.pack('!HIHH', timeSigned >> 32, timeSigned & 0xFFFFFFFF, Key.FUDGE, len(mac)) + mac +
+			struct.pack('!HHH', struct.unpack_from('!H', wire)[0], 0, 0)
+		)
+		rr = encodeName(self.__name) + struct.pack('!HHIH', Type.TSIG, Class.ANY, 0, len(rdata)) + rdata
+		
+		arCount = struct.unpack_from('!H', wire, 10)[0]
+		return (wire[:10] + struct.pack('!H', arCount + 1) + wire[12:] + rr, mac)
+	
+	
+	## Returns the TSIG error of the response (NOERROR if the MAC is valid).
+	def verify(self, response, requestMac):
+		if not response.additional or response.additional[-1].type != Type.TSIG:
+			raise Exception('Response is not signed')
+		
+		tsig = response.additional[-1]
+		algorithm, offset = response.decodeName(tsig)
+		offset -= tsig.rdataOffset
+		timeHigh, timeLow, fudge, macSize = struct.unpack_from('!HIHH', tsig.rdata, offset)
+		offset += 10
+		mac = tsig.rdata[offset:offset + macSize]
+		offset += macSize
+		originalId, error, otherSize = struct.unpack_from('!HHH', tsig.rdata, offset)
+		other = tsig.rdata[offset + 6:offset + 6 + otherSize]
+		
+		if error != Rcode.NOERROR:
+			return Rcode(error)
+		
+		timeSigned = (timeHigh << 32) | timeLow
+		
+		wire = response.wire[:tsig.offset]
+		arCount = struct.unpack_from('!H', wire, 10)[0]
+		wire = struct.pack('!H', originalId) + wire[2:10] + struct.pack('!H', arCount - 1) + wire[12:]
+		
+		expected = self.__mac(
+			struct.pack('!H', len(requestMac)) + requestMac + wire +
+			self.__variables(timeSigned, error, other)
+		)
+		
+		if not hmac.compare_digest(mac, expected):
+			raise Exception('Response has an invalid TSIG signature')
+		
+		if abs(time.time() - timeSigned) > fudge:
+			raise Exception('Response has an invalid TSIG time')
+		
+		return Rcode.NOERROR
+
+
+
+## The first name server of /etc/resolv.conf (or localhost)
+def resolver():
+	with contextlib.suppress(OSError):
+		for line in sir.util.readFile('/etc/resolv.conf').splitlines():
+			fields = line.split()
+			if len(fields) >= 2 and fields[0] == 'nameserver':
+				return fields[1]
+	
+	return '127.0.0.1'
+
+
+
+## A TCP connection to one server, which is reused for all messages.
+class Connection:
+	def __init__(self, server, port = 53, key = None, timeout = 30):
+		self.__server  = server
+		self.__port    = port
+		self.__key     = key
+		self.__timeout = timeout
+		self.__socket  = None
+	
+	
+	def __enter__(self):
+		return self
+	
+	
+	def __exit__(self, *exc):
+		self.close()
+	
+	
+	def close(self):
+		if self.__socket is not None:
+			self.__socket.close()
+			self.__socket = None
+	
+	
+	def __recv(self, size):
+		data = b''
+		while len(data) < size:
+			chunk = self.__socket.recv(size - len(data))
+			if not chunk:
+				raise ConnectionError('Connection closed by %s port %s' % (self.__server, self.__port))
+			data += chunk
+		
+		return data
+	
+	
+	def __roundTrip(self, wires):
+		if self.__socket is None:
+			logging.info('Connecting to %s port %s', self.__server, self.__port)
+			self.__socket = socket.create_connection((self.__server, self.__port), self.__timeout)
+		
+		self.__socket.sendall(b''.join(struct.pack('!H', len(wire)) + wire for wire in wires))
+		return [self.__recv(struct.unpack('!H', self.__recv(2))[0]) for wire in wires]
+	
+	
+	## Sends a message and returns the (verified) response and its rcode.
+	def exchange(self, wire):
+		return self.exchangeMany([wire])[0]
+	
+	
+	## Like exchange(), but for many messages. The messages are pipelined, so
+	## there is only one round trip per window (and not per message).
+	def exchangeMany(self, wires, window = 64):
+		results = []
+		
+		for start in range(0, len(wires), window):
+			requests = {}
+			for wire in wires[start:start + window]:
+				requestMac = b''
+				if self.__key is not None:
+					wire, requestMac = self.__key.sign(wire)
+				requests[struct.unpack_from('!H', wire)[0]] = (wire, requestMac)
+			
+			## A reused connection might have been closed by the server in the
+			## meantime, so give it a second chance with a new one.
+			reused = self.__socket is not None
+			try:
+				responses = self.__roundTrip([wire for wire, requestMac in requests.values()])
+			except (ConnectionError, socket.timeout):
+				self.close()
+				if not reused:
+					raise
+				responses = self.__roundTrip([wire for wire, requestMac in requests.values()])
+			
+			## Responses might arrive in any order
+			byId = {}
+			for response in map(Message, responses):
+				if response.id not in requests:
+					raise Exception('Response from %s port %s has a wrong id' % (self.__server, self.__port))
+				
+				rcode = Rcode(response.rcode)
+				if self.__key is not None:
+					error = self.__key.verify(response, requests[response.id][1])
+					if error != Rcode.NOERROR:
+						rcode = error
+				
+				byId[response.id] = (response, rcode)
+			
+			results.extend(byId[id] for id in requests)
+		
+		return results
+	
+	
+	def __header(self, opcode, qdCount, nsCount = 0, flags = 0):
+		return struct.pack('!HHHHHH', struct.unpack('!H', os.urandom(2))[0], (opcode << 11) | flags, qdCount, 0, nsCount, 0)
+	
+	
+	## Queries type for every name. Returns the responses in the same order.
+	## Recursive queries are meant for resolvers (they set the RD flag).
+	def query(self, names, type, recursive = False):
+		wires = []
+		for name in names:
+			## Don't send two messages with the same id at the same time
+			while True:
+				wire = self.__header(Opcode.QUERY, 1, flags = 0x0100 if recursive else 0) + encodeName(name) + struct.pack('!HH', type, Class.IN)
+				if wire[:2] not in (other[:2] for other in wires[-63:]):
+					break
+			wires.append(wire)
+		
+		return [response for response, rcode in self.exchangeMany(wires)]
+	
+	
+	## The RRset of type of every name as {name: (ttl, [rdata], cname)}. The TTL
+	## of a missing RRset is None. If the name is a CNAME, cname is its target
+	## (None otherwise) and the RRset is the one of the end of the CNAME chain,
+	## as far as the server included it in the answer (authoritative servers do
+	## for targets in their zones).
+	def rrsets(self, names, type):
+		rrsets = {}
+		for name, response in zip(names, self.query(names, type)):
+			if response.rcode not in (Rcode.NOERROR, Rcode.NXDOMAIN):
+				raise Exception('Query for %s on %s port %s failed: %s' % (name, self.__server, self.__port, Rcode(response.rcode).name))
+			
+			owner = name
+			cname = None
+			for _ in range(8):
+				rrs = response.rrset(owner, Type.CNAME)
+				if not rrs:
+					break
+				
+				owner = response.decodeName(rrs[0])[0]
+				if cname is None:
+					cname = owner
+			
+			rrs = response.rrset(owner, type)
+			rrsets[name] = (min((rr.ttl for rr in rrs), default = None), [rr.rdata for rr in rrs], cname)
+		
+		return rrsets
+	
+	
+	## The zone of every name as {name: (zone, ttl)}: The owner of the SOA
+	## record in the answer (for the apex of a zone) or in the authority section
+	## (for every other name, even if it doesn't exist yet) of a recursive
+	## query. ttl is the TTL of the SOA record.
+	def zones(self, names):
+		zones = {}
+		for name, response in zip(names, self.query(names, Type.SOA, recursive = True)):
+			if response.rcode not in (Rcode.NOERROR, Rcode.NXDOMAIN):
+				raise Exception('SOA query for %s on %s port %s failed: %s' % (name, self.__server, self.__port, Rcode(response.rcode).name))
+			
+			soa = [rr for rr in response.answer + response.authority if rr.type == Type.SOA]
+			if not soa:
+				raise Exception('%s port %s returned no SOA record for %s' % (self.__server, self.__port, name))
+			
+			zones[name] = (soa[0].name, soa[0].ttl)
+		
+		return zones
+	
+	
+	## Sends one update message for zone. Returns the rcode of the response.
+	def update(self, zone, changes):
+		wire = (
+			self.__header(Opcode.UPDATE, 1, len(changes)) +
+			encodeName(zone) + struct.pack('!HH', Type.SOA, Class.IN) +
+			b''.join(change.wire for change in changes)
+		)
+		
+		return self.exchange(wire)[1]
@@ -0,0 +1,176 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## TLSA fingerprints of certs. A PEM file is parsed once, the DER of the cert
+## and its SPKI are just views into the decoded data, and all selector/type
+## combinations are hashed from these views.
+
+import base64
+import binascii
+import datetime
+import hashlib
+import re
+import sir.util
+
+
+
+PEM = re.compile(rb'-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----', re.S)
+
+
+
+## Returns tag, start of the content and end of the DER element at offset.
+def tlv(der, offset):
+	tag    = der[offset]
+	length = der[offset + 1]
+	offset += 2
+	
+	if length & 0x80:
+		size   = length & 0x7F
+		length = int.from_bytes(der[offset:offset + size], 'big')
+		offset += size
+	
+	return (tag, offset, offset + length)
+
+
+
+def parseTime(tag, value):
+	value = bytes(value).decode('ascii')
+	
+	## UTCTime has a two digit year
+	if tag == 0x17:
+		value = ('19' if int(value[:2]) >= 50 else '20') + value
+	
+	return datetime.datetime.strptime(value, '%Y%m%d%H%M%SZ').replace(tzinfo = datetime.timezone.utc)
+
+
+
+## Just the parts of a X.509 cert needed for TLSA records (and for renewals)
+class Certificate:
+	@property
+	def der(self):
+		return self.__der
+	
+	@property
+	def spki(self):
+		return self.__spki
+	
+	@property
+	def issuer(self):
+		return self.__issuer
+	
+	@property
+	def subject(self):
+		return self.__subject
+	
+	@property
+	def notBefore(self):
+		return parseTime(*self.__notBefore)
+	
+	@property
+	def notAfter(self):
+		return parseTime(*self.__notAfter)
+	
+	def __init__(self, der):
+		self.__der = der = memoryview(der)
+		
+		tag, start, end = tlv(der, 0)
+		tag, offset, end = tlv(der, start)      ## tbsCertificate
+		
+		fields = []
+		while offset < end:
+			tag, start, next = tlv(der, offset)
+			if tag != 0xA0:                     ## Skip the optional version
+				fields.append((tag, offset, start, next))
+			offset = next
+		
+		## serialNumber, signature, issuer, validity, subject, subjectPublicKeyInfo
+		issuer, validity, subject, spki = fields[2:6]
+		self.__issuer  = der[issuer[1]:issuer[3]]
+		self.__subject = der[subject[1]:subject[3]]
+		self.__spki    = der[spki[1]:spki[3]]
+		
+		tag, start, next = tlv(der, validity[2])
+		self.__notBefore = (tag, der[start:next])
+		tag, start, next = tlv(der, next)
+		self.__notAfter  = (tag, der[start:next])
+	
+	
+	## The data selected by a TLSA selector (0: full cert, 1: SPKI)
+	def selected(self, selector):
+		if selector == 0:
+			return self.__der
+		
+		elif selector == 1:
+			return self.__spki
+		
+		else:
+			raise Exception('Unknown TLSA selector %s' % selector)
+
+
+
+def loadPem(pem):
+	return [Certificate(base64.b64decode(b''.join(block.split()))) for block in PEM.findall(pem)]
+
+
+
+## The TLSA matching type applied to data
+def match(data, type):
+	if type == 0:
+		return binascii.b2a_hex(data).decode('ascii')
+	
+	elif type == 1:
+		return hashlib.sha256(data).hexdigest()
+	
+	elif type == 2:
+		return hashlib.sha512(data).hexdigest()
+	
+	else:
+		raise Exception('Unknown TLSA type %s' % type)
+
+
+
+## The CA of a chain which issued the leaf cert (the trust anchor for the
+## DANE_TA and PKIX_TA usages).
+def issuerOf(leaf, chain):
+	for cert in chain:
+		if cert.subject == leaf.issuer and cert.der != leaf.der:
+			return cert
+	
+	## A self signed cert is its own trust anchor
+	if leaf.subject == leaf.issuer:
+		return leaf
+	
+	raise Exception('Chain has no cert issuing the leaf cert')
+
+
+
+## Hashes of one cert for every (selector, type) in keys
+def hashes(cert, keys):
+	return {(selector, type): match(cert.selected(selector), type) for selector, type in keys}
+
+
+
+## Calls computeHashes() of every cert with all (usage, selector, type)
+## combinations needed by its records. Hashing releases the GIL, so this runs
+## on a thread pool.
+def precompute(records, jobs = None):
+	needs = {}
+	for record in records:
+		needs.setdefault(record.cert, set()).add((record.usage, record.selector, record.type))
+	
+	return sir.util.runParallel(lambda cert: cert.computeHashes(needs[cert]), needs, jobs)
@@ -0,0 +1,159 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import sir.util
+
+
+
+## TLSA hashes of cert files, which survive the process (unless the file name
+## is None). An entry is only used, if path, size, mtime and the SHA-256 of the
+## content of the file (and of the files it depends on) are still the same, so
+## a changed cert invalidates its entries automatically.
+class HashCache:
+	@sir.util.classproperty
+	def DEFAULT_FILE():
+		return '/var/lib/sir/cache/hashcache.sqlite'
+	
+	@property
+	def fileName(self):
+		return self.__fileName
+	
+	@property
+	def hits(self):
+		return self.__hits
+	
+	@property
+	def misses(self):
+		return self.__misses
+	
+	def __init__(self, fileName = None):
+		self.__fileName = fileName
+		self.__lock     = threading.Lock()
+		self.__hits     = 0
+		self.__misses   = 0
+		self.__writable = True
+		self.__db       = None
+		self.__level    = logging.DEBUG if fileName == HashCache.DEFAULT_FILE else logging.WARNING
+	
+	
+	## The database is opened on first use, so steps without TLSA records don't
+	## need access to it. Users without access to the default file aren't worth
+	## a warning (in every cron mail), unlike a file given explicitly.
+	def __open(self):
+		if self.__db is not None:
+			return
+		
+		try:
+			self.__db = sqlite3.connect(':memory:' if self.__fileName is None else self.__fileName, check_same_thread = False)
+			self.__createTable()
+		
+		except sqlite3.Error as e:
+			logging.log(self.__level, 'Can\'t use hash cache %s (%s), hashes will only be cached in memory', self.__fileName, e)
+			self.__fileName = None
+			self.__db = sqlite3.connect(':memory:', check_same_thread = False)
+			self.__createTable()
+	
+	
+	def __createTable(self):
+		with self.__db:
+			self.__db.execute('''
+				CREATE TABLE IF NOT EXISTS hashes (
+					path     TEXT    NOT NULL,
+					size     INTEGER NOT NULL,
+					mtime    INTEGER NOT NULL,
+					digest   TEXT    NOT NULL,
+					selector INTEGER NOT NULL,
+					type     INTEGER NOT NULL,
+					hash     TEXT    NOT NULL,
+					PRIMARY KEY (path, selector, type)
+				)
+			''')
+	
+	
+	## Returns the hashes of the file for every (selector, type) in keys. The
+	## missing ones are calculated by compute(content of the file, missing keys),
+	## which returns them as a dict, and stored. If the hashes also depend on
+	## the content of other files (e.g. the cert picking its issuer out of a
+	## chain), they are given as depends and are part of the digest.
+	def get(self, path, keys, compute, depends = ()):
+		with open(path, 'rb') as f:
+			stat = os.fstat(f.fileno())
+			data = f.read()
+		
+		digest = hashlib.sha256(data)
+		for dependency in depends:
+			digest.update(hashlib.sha256(sir.util.readFile(dependency, 'rb')).digest())
+		
+		identity = (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+		
+		with self.__lock:
+			self.__open()
+			rows = self.__db.execute(
+				'SELECT selector, type, hash FROM hashes WHERE path = ? AND size = ? AND mtime = ? AND digest = ?',
+				identity,
+			)
+			
+			hashes = {(selector, type): hash for selector, type, hash in rows if (selector, type) in keys}
+			missing = set(keys) - hashes.keys()
+			
+			self.__hits   += len(hashes)
+			self.__misses += len(missing)
+		
+		if not missing:
+			return hashes
+		
+		computed = compute(data, missing)
+		hashes.update(computed)
+		
+		with self.__lock:
+			if self.__writable:
+				try:
+					with self.__db:
+						self.__db.executemany(
+							'INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)',
+							(identity + key + (hash,) for key, hash in computed.items()),
+						)
+				
+				except sqlite3.Error as e:
+					logging.log(self.__level, 'Can\'t write to hash cache %s (%s), new hashes won\'t be stored', self.__fileName, e)
+					self.__writable = False
+		
+		return hashes
+	
+	
+	## Removes the entries of files, which don't exist any more or which are
+	## not in keep (if given). Returns the number of removed entries.
+	def prune(self, keep = None):
+		with self.__lock:
+			self.__open()
+			paths = [row[0] for row in self.__db.execute('SELECT DISTINCT path FROM hashes')]
+			gone = [path for path in paths if not os.path.exists(path) or (keep is not None and path not in keep)]
+			
+			with self.__db:
+				return sum(self.__db.execute('DELETE FROM hashes WHERE path = ?', (path,)).rowcount for path in gone)
+	
+	
+	def close(self):
+		if self.__db is not None:
+			self.__db.close()
+			self.__db = None
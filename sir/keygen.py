@@ -0,0 +1,85 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## In process key and csr creation. This is the same as what
+## `openssl req -newkey` does, but without forking and without reading and
+## writing a temporary openssl config for every cert.
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed448
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+import sir.util
+
+
+
+## Maps a key type, as it would be passed to `openssl req -newkey`, to a
+## function creating such a key and the digest to sign the csr with. Returns
+## None if the type can only be handled by openssl.
+def keyGenerator(type):
+	algorithm, _, param = type.partition(':')
+	
+	if algorithm == 'rsa' and param.isdigit():
+		return (lambda: rsa.generate_private_key(public_exponent = 65537, key_size = int(param)), hashes.SHA256())
+	
+	elif algorithm == 'ed25519' and param == '':
+		return (ed25519.Ed25519PrivateKey.generate, None)
+	
+	elif algorithm == 'ed448' and param == '':
+		return (ed448.Ed448PrivateKey.generate, None)
+	
+	else:
+		return None
+
+
+
+## extraConf is raw openssl config, which can't be applied to a csr built here.
+def isSupported(type, extraConf):
+	return keyGenerator(type) is not None and not extraConf.strip()
+
+
+
+def createKeyAndCsr(type, domains, keyFile, csrFile):
+	generate, digest = keyGenerator(type)
+	key = generate()
+	
+	builder = x509.CertificateSigningRequestBuilder()
+	
+	## Same layout as created by openssl: A single domain goes into the CN, more
+	## domains go into the SAN extension with an empty subject.
+	if len(domains) > 1:
+		builder = builder.subject_name(x509.Name([]))
+		builder = builder.add_extension(
+			x509.SubjectAlternativeName([x509.DNSName(domain.name) for domain in domains]),
+			critical = False,
+		)
+	
+	else:
+		builder = builder.subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, domains[0].name)]))
+	
+	csr = builder.sign(key, digest)
+	
+	sir.util.writeFile(keyFile, key.private_bytes(
+		encoding             = serialization.Encoding.PEM,
+		format               = serialization.PrivateFormat.PKCS8,
+		encryption_algorithm = serialization.NoEncryption(),
+	), 0o600)
+	sir.util.writeFile(csrFile, csr.public_bytes(serialization.Encoding.PEM))
@@ -0,0 +1,230 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+
+## Where the metrics of the current run are recorded (nowhere by default). Like
+## sir.util.OUTPUT it's a context variable, so concurrent runs (see sir.api)
+## don't mix up their metrics.
+CURRENT = contextvars.ContextVar('metrics', default = None)
+
+## {name: (type, help)} of every metric. Durations of summaries are added up
+## (with a count), the ones of gauges replace the last value.
+METRICS = collections.OrderedDict([
+	('sir_step_duration_seconds',            ('summary', 'Wall time of the steps')),
+	('sir_step_items_total',                 ('counter', 'Items (certs or servers) done or failed by the steps')),
+	('sir_last_run_timestamp_seconds',       ('gauge',   'Time the last run of the step finished')),
+	('sir_last_run_success',                 ('gauge',   'Whether the last run of the step succeeded')),
+	('sir_cert_duration_seconds',            ('gauge',   'Time the last key creation, signing or rollover of the cert took')),
+	('sir_cert_not_after_timestamp_seconds', ('gauge',   'End of the validity of the current cert')),
+	('sir_command_duration_seconds',         ('summary', 'Time of the external commands (openssl, sign and rollover scripts, nsupdate)')),
+	('sir_command_failures_total',           ('counter', 'External commands, which failed')),
+	('sir_update_duration_seconds',          ('summary', 'Time to update a server (including the queries with --diff)')),
+	('sir_update_messages_total',            ('counter', 'Update messages sent to a server')),
+	('sir_update_changes_total',             ('counter', 'Changes (update lines) sent to a server')),
+	('sir_update_bytes_total',               ('counter', 'Size of the update messages sent to a server')),
+	('sir_update_failures_total',            ('counter', 'Updates of a server, which failed')),
+	('sir_hash_cache_hits_total',            ('counter', 'TLSA hashes found in the hash cache')),
+	('sir_hash_cache_misses_total',          ('counter', 'TLSA hashes, which had to be calculated')),
+])
+
+
+
+## The metrics of a run. They are written as a whole, in the format of the
+## textfile collector of the Prometheus node_exporter or as JSON.
+class Metrics:
+	def __init__(self):
+		self.__lock    = threading.Lock()
+		self.__samples = {}
+	
+	
+	## The sample of name with labels, as (name, sorted label items)
+	def __key(self, name, labels):
+		if name not in METRICS:
+			raise Exception('Unknown metric %s' % name)
+		
+		return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+	
+	
+	def add(self, name, value = 1, **labels):
+		key = self.__key(name, labels)
+		with self.__lock:
+			self.__samples[key] = self.__samples.get(key, 0) + value
+	
+	
+	def set(self, name, value, **labels):
+		key = self.__key(name, labels)
+		with self.__lock:
+			self.__samples[key] = value
+	
+	
+	## Records a duration (or any other observation) of a summary or gauge
+	def observe(self, name, value, **labels):
+		key = self.__key(name, labels)
+		with self.__lock:
+			if METRICS[name][0] == 'summary':
+				total, count = self.__samples.get(key, (0, 0))
+				self.__samples[key] = (total + value, count + 1)
+			else:
+				self.__samples[key] = value
+	
+	
+	## {name: [(sample name, labels, value)]} in the order of METRICS. The extra
+	## labels are added to every sample.
+	def samples(self, **extra):
+		with self.__lock:
+			samples = sorted(self.__samples.items())
+		
+		extra    = tuple((key, str(value)) for key, value in extra.items())
+		families = collections.OrderedDict((name, []) for name in METRICS)
+		for (name, labels), value in samples:
+			labels = tuple(sorted(dict(labels + extra).items()))
+			if METRICS[name][0] == 'summary':
+				families[name].append((name + '_sum', labels, value[0]))
+				families[name].append((name + '_count', labels, value[1]))
+			else:
+				families[name].append((name, labels, value))
+		
+		return collections.OrderedDict((name, samples) for name, samples in families.items() if samples)
+	
+	
+	def text(self, **extra):
+		lines = []
+		for name, samples in self.samples(**extra).items():
+			lines.append('# HELP %s %s' % (name, METRICS[name][1]))
+			lines.append('# TYPE %s %s' % (name, METRICS[name][0]))
+			
+			for sample, labels, value in samples:
+				if labels:
+					sample += '{%s}' % ','.join('%s="%s"' % (key, escape(value)) for key, value in labels)
+				
+				lines.append('%s %s' % (sample, number(value)))
+		
+		return ''.join(line + '\n' for line in lines)
+	
+	
+	def json(self, **extra):
+		return json.dumps(
+			{
+				name: {
+					'type'    : METRICS[name][0],
+					'help'    : METRICS[name][1],
+					'samples' : [{'name': sample, 'labels': dict(labels), 'value': value} for sample, labels, value in samples],
+				}
+				for name, samples in self.samples(**extra).items()
+			},
+			indent = '\t',
+		) + '\n'
+	
+	
+	## Replaces fileName atomically (JSON, if the name ends with .json), so the
+	## node_exporter never reads half a file. The temporary file starts with a
+	## dot and doesn't end with .prom, so it's ignored by the node_exporter.
+	def write(self, fileName, **extra):
+		data = (self.json(**extra) if fileName.endswith('.json') else self.text(**extra)).encode('UTF-8')
+		dir  = os.path.dirname(os.path.abspath(fileName))
+		
+		fd, tmp = tempfile.mkstemp(dir = dir, prefix = '.%s.' % os.path.basename(fileName))
+		try:
+			with open(fd, 'wb') as f:
+				f.write(data)
+				f.flush()
+				os.fsync(f.fileno())
+			
+			os.chmod(tmp, 0o644)
+			os.replace(tmp, fileName)
+		
+		except BaseException:
+			with contextlib.suppress(FileNotFoundError):
+				os.remove(tmp)
+			raise
+
+
+
+def escape(value):
+	return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+
+def number(value):
+	if isinstance(value, bool):
+		return str(int(value))
+	
+	if isinstance(value, float) and value in (float('inf'), float('-inf')):
+		return '+Inf' if value > 0 else '-Inf'
+	
+	return repr(value)
+
+
+
+## The following functions record to the metrics of the current run, if there
+## are any.
+def add(name, value = 1, **labels):
+	metrics = CURRENT.get()
+	if metrics is not None:
+		metrics.add(name, value, **labels)
+
+
+
+def set(name, value, **labels):
+	metrics = CURRENT.get()
+	if metrics is not None:
+		metrics.set(name, value, **labels)
+
+
+
+def observe(name, value, **labels):
+	metrics = CURRENT.get()
+	if metrics is not None:
+		metrics.observe(name, value, **labels)
+
+
+
+## Records the time the block takes, also if it raises
+@contextlib.contextmanager
+def timer(name, **labels):
+	start = time.monotonic()
+	try:
+		yield
+	finally:
+		observe(name, time.monotonic() - start, **labels)
+
+
+
+## Decorator recording the time of every call of a function
+def timed(name, **labels):
+	def decorator(fn):
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			with timer(name, **labels):
+				return fn(*args, **kwargs)
+		
+		return wrapper
+	
+	return decorator
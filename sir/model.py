@@ -16,16 +16,19 @@
 # You should have received a copy of the GNU General Public License
 # along with Sir.  If not, see <http://www.gnu.org/licenses/>.
 
-from OpenSSL import crypto
-from OpenSSL._util import lib as cryptolib
-import binascii
+import datetime
 import enum
-import hashlib
+import importlib
 import logging
 import operator
 import os
+import re
 import shlex
 import sys
+import sir.dns
+import sir.fingerprint
+import sir.hashcache
+import sir.state
 import sir.util
 
 
@@ -35,6 +38,11 @@ class TlsaUsage(enum.Enum):
 	PKIX_EE = 1 ## Server cert must be signed by a CA known to the client and the given cert must be the server cert.
 	DANE_TA = 2 ## The given cert must be somewhere in the cain.
 	DANE_EE = 3 ## The given cert must be the server cert.
+	
+	## Usages refering to a CA in the chain instead of the server cert
+	@sir.util.classproperty
+	def TRUST_ANCHORS():
+		return (TlsaUsage.PKIX_TA, TlsaUsage.DANE_TA)
 
 
 
@@ -52,6 +60,8 @@ class TlsaType(enum.Enum):
 
 
 class Domain:
+	__slots__ = ('__name', '__certs')
+	
 	@property
 	def name(self):
 		return self.__name
@@ -62,17 +72,29 @@ class Domain:
 		return 'DNS:%s' % self.__name
 	
 	
+	## The certs containing this domain
+	@property
+	def certs(self):
+		return self.__certs.keys()
+	
+	
 	def __init__(self, name):
 		self.__name  = name
+		self.__certs = {}
 	
 	
 	def __str__(self):
 		return 'Domain %s' % self.__name
+	
+	
+	def addCert(self, cert):
+		self.__certs[cert] = None
 
 
 
 class DomainSet:
-	__domains = {}
+	def __init__(self):
+		self.__domains = {}
 	
 	
 	def get(self, name):
@@ -82,6 +104,11 @@ class DomainSet:
 		return self.__domains[name]
 	
 	
+	## The domains matching one of the glob patterns
+	def find(self, patterns):
+		return sir.util.globLookup(self.__domains, patterns)
+	
+	
 	def foo(self):
 		return self.__domains.values()
 
@@ -103,6 +130,11 @@ class Cert:
 		return ''
 	
 	
+	@sir.util.classproperty
+	def DEFAULT_KEY_BACKEND():
+		return 'native'
+	
+	
 	@sir.util.classproperty
 	def DEFAULT_KEY_DIR():
 		return '/var/lib/sir/keys/'
@@ -143,6 +175,31 @@ class Cert:
 		return os.path.join(self.__keyDir, self.fileName)
 	
 	
+	## The sign script, which will actually be used (after applying the
+	## fallbacks) or None.
+	@property
+	def signScript(self):
+		return self.__actualScript('sign', self.__signScript)
+	
+	
+	## Max. number of sign scripts running at the same time (None: unlimited)
+	@property
+	def signConcurrency(self):
+		return self.__signConcurrency
+	
+	
+	## Max. number of sign scripts started per minute (None: unlimited)
+	@property
+	def signRate(self):
+		return self.__signRate
+	
+	
+	## Renew the cert, if it expires within this timedelta (None: always renew)
+	@property
+	def renewBefore(self):
+		return self.__renewBefore
+	
+	
 	@property
 	def csrFile(self):
 		return os.path.join(self.__csrDir, self.fileName)
@@ -161,6 +218,10 @@ class Cert:
 	def __init__(self,
 			name, signScript = None, rolloverScript = None,
 			type    = DEFAULT_TYPE()     , extraConf = DEFAULT_EXTRA_CONF(),
+			keyBackend = DEFAULT_KEY_BACKEND(),
+			signConcurrency = None, signRate = None,
+			renewBefore = None,
+			hashCache = None,
 			
 			## The following default values are redundant in every cert (they
 			## should actually be the same), but this prevents creating
@@ -175,13 +236,18 @@ class Cert:
 		self.__rolloverScript = rolloverScript
 		self.__type           = type
 		self.__extraConf      = extraConf
+		self.__keyBackend     = sir.util.noNone(keyBackend, Cert.DEFAULT_KEY_BACKEND)
+		self.__signConcurrency = signConcurrency
+		self.__signRate       = signRate
+		self.__renewBefore    = sir.util.parseDuration(renewBefore)
 		self.__keyDir         = keyDir
 		self.__csrDir         = csrDir
 		self.__certDir        = certDir
 		self.__chainDir       = chainDir
 		
 		self.__domains        = []
-		self.__hashCache      = {}
+		self.__hashCache      = hashCache
+		self.__hashes         = {}
 	
 	
 	def __str__(self):
@@ -191,6 +257,7 @@ class Cert:
 	def addDomain(self, domain):
 		if not domain in self.__domains:
 			self.__domains.append(domain)
+			domain.addCert(self)
 		## TODO Raise exception, if domain already exists?
 	
 	
@@ -201,6 +268,19 @@ class Cert:
 		sir.util.rmFile(self.keyFile)
 		sir.util.rmFile(self.csrFile)
 		
+		if self.__keyBackend == 'native':
+			## cryptography takes long to import, so only the key step loads it
+			keygen = importlib.import_module('sir.keygen')
+			if keygen.isSupported(self.__type, sir.util.noNone(self.__extraConf)):
+				logging.info('Creating key and csr for %s in process', self.__name)
+				keygen.createKeyAndCsr(self.__type, self.__domains, self.keyFile, self.csrFile)
+				return
+			
+			logging.info('Key type %s or extraConf of %s is not supported in process, falling back to openssl', self.__type, self.__name)
+		
+		elif self.__keyBackend != 'openssl':
+			raise Exception('Unknown key backend %s for %s' % (self.__keyBackend, self.__name))
+		
 		args = [
 			'openssl', 'req',
 			'-batch',               ## Don't ask anything
@@ -252,7 +332,7 @@ class Cert:
 		
 		else:
 			## No script should be used
-			if userPath == NO_SCRIPT:
+			if userPath == Cert.NO_SCRIPT:
 				return None
 			
 			## Use user script
@@ -264,9 +344,10 @@ class Cert:
 		if not self.__domains:
 			return
 		
-		script = self.__actualScript('sign', self.__signScript)
+		script = self.signScript
 		if script is not None:
-			print(sir.util.sh(shlex.split(script) + [self.csrFile, self.certFile, self.chainFile]))
+			sir.util.output(sir.util.sh(shlex.split(script) + [self.csrFile, self.certFile, self.chainFile]))
+			self.__hashes = {}
 	
 	
 	def rollover(self):
@@ -275,63 +356,157 @@ class Cert:
 		
 		script = self.__actualScript('rollover', self.__rolloverScript)
 		if script is not None:
-			print(sir.util.sh(shlex.split(script) + [self.keyFile, self.certFile, self.chainFile]))
+			sir.util.output(sir.util.sh(shlex.split(script) + [self.keyFile, self.certFile, self.chainFile]))
 	
 	
-	def getHash(self, selector, type):
-		key = (selector, type)
-		if key not in self.__hashCache:
-			cert = crypto.load_certificate(crypto.FILETYPE_PEM, sir.util.readFile(self.certFile))
-			
-			if selector == TlsaSelector.FULL:
-				data = crypto.dump_certificate(crypto.FILETYPE_ASN1, cert)
+	## End of the validity of the current cert or None, if there is no cert yet.
+	@property
+	def notAfter(self):
+		try:
+			certs = sir.fingerprint.loadPem(sir.util.readFile(self.certFile, 'rb'))
+		except FileNotFoundError:
+			return None
+		
+		return certs[0].notAfter if certs else None
+	
+	
+	## Whether step has to be done for this cert according to its progress in
+	## state (see sir.state). A new cycle only starts after the last one was
+	## finished and (with a renewBefore) if the cert expires soon. A step after
+	## the key step is due, if the step before it is done, but this step isn't
+	## or was done with a different cert. The rollover additionally waits until
+	## it is safe. With fresh, a cert without any recorded progress is due for
+	## every step it would be due for the key step, so a single step can be run
+	## without a state (like before the state existed).
+	def isDue(self, step, state, now = None, fresh = False):
+		cycle, done = state.progress(self)
+		
+		if now is None:
+			now = datetime.datetime.now(datetime.timezone.utc)
+		
+		if fresh and cycle is None and step != 'key':
+			return self.isDue('key', state, now)
+		
+		if step == 'key':
+			if 'key' in done and 'updatetlsa' not in done:
+				return False
 			
-			elif selector == TlsaSelector.SPKI:
-				bio = crypto._new_mem_buf()
-				cryptolib.i2d_PUBKEY_bio(bio, cert.get_pubkey()._pkey)
-				data = crypto._bio_to_string(bio)
+			return self.__renewBefore is None or self.__expires(now)
+		
+		previous = sir.state.STEPS[sir.state.STEPS.index(step) - 1]
+		if previous not in done:
+			return False
+		
+		if step == 'cert':
+			return 'cert' not in done
+		
+		if step == 'rollover':
+			at = self.rolloverAt(state)
+			return at is not None and at <= now.timestamp()
+		
+		return step not in done or done[step][1] != done[previous][1]
+	
+	
+	## The time the pending rollover of this cert is safe (see sir.verify) or
+	## None, if there is no verified cert waiting for its rollover.
+	def rolloverAt(self, state):
+		cycle, done = state.progress(self)
+		
+		if 'verifytlsa' in done and ('rollover' not in done or done['rollover'][1] != done['verifytlsa'][1]):
+			return done['verifytlsa'][0]
+		
+		return None
+	
+	
+	def __expires(self, now):
+		notAfter = self.notAfter
+		return notAfter is None or notAfter - now <= self.__renewBefore
+	
+	
+	## Hashes for the given (usage, selector, type) combinations. The cert file
+	## (and the chain file for trust anchor usages) is only parsed once. The
+	## issuer is picked out of the chain by the cert, so the cached hashes of
+	## the chain depend on the cert file, too.
+	def computeHashes(self, needs):
+		keys = {}
+		for usage, selector, type in needs:
+			keys.setdefault(usage in TlsaUsage.TRUST_ANCHORS, set()).add((selector.value, type.value))
+		
+		for anchor, anchorKeys in keys.items():
+			path = self.chainFile if anchor else self.certFile
+			compute = lambda pem, missing: sir.fingerprint.hashes(self.__fingerprintedCert(pem, anchor), missing)
 			
+			if self.__hashCache is None:
+				hashes = compute(sir.util.readFile(path, 'rb'), anchorKeys)
 			else:
-				raise Exception('Unknown TLSA selector %s' % selector)
-			
+				hashes = self.__hashCache.get(path, anchorKeys, compute, (self.certFile,) if anchor else ())
 			
-			if type == TlsaType.EXACT:
-				self.__hashCache[key] = binascii.b2a_hex(data).decode('ascii')
-			
-			elif type == TlsaType.SHA256:
-				self.__hashCache[key] = hashlib.sha256(data).hexdigest()
-			
-			elif type == TlsaType.SHA512:
-				self.__hashCache[key] = hashlib.sha512(data).hexdigest()
-			
-			else:
-				raise Exception('Unknown TLSA type %s' % type)
+			for (selector, type), hash in hashes.items():
+				self.__hashes[(anchor, selector, type)] = hash
+	
+	
+	def __fingerprintedCert(self, pem, anchor):
+		certs = sir.fingerprint.loadPem(pem)
+		if not certs:
+			raise Exception('No cert found for %s' % self.__name)
+		
+		if anchor:
+			return sir.fingerprint.issuerOf(sir.fingerprint.loadPem(sir.util.readFile(self.certFile, 'rb'))[0], certs)
+		else:
+			return certs[0]
+	
+	
+	## Uses the hashes of computeHashes(), if available.
+	def getHash(self, selector, type, usage = TlsaUsage.DANE_EE):
+		key = (usage in TlsaUsage.TRUST_ANCHORS, selector.value, type.value)
+		if key not in self.__hashes:
+			self.computeHashes([(usage, selector, type)])
 		
-		return self.__hashCache[key]
+		return self.__hashes[key]
 
 
 
 class CertSet:
-	__certs = {}
+	@property
+	def hashCache(self):
+		return self.__hashCache
+	
+	
+	## All certs share the hash cache. Without one, hashes are cached in memory.
+	def __init__(self, hashCache = None):
+		if hashCache is None:
+			hashCache = sir.hashcache.HashCache()
+		
+		self.__certs     = {}
+		self.__hashCache = hashCache
 	
 	
 	def add(self, name, *args, **kwargs):
 		if name in self.__certs:
 			raise Exception('Cert %s already created' % name)
 		
-		self.__certs[name] = Cert(name, *args, **kwargs)
+		self.__certs[name] = Cert(name, *args, hashCache = self.__hashCache, **kwargs)
 	
 	
 	def get(self, cert):
 		return self.__certs[cert]
 	
 	
+	## The certs with a name matching one of the glob patterns
+	def find(self, patterns):
+		return sir.util.globLookup(self.__certs, patterns)
+	
+	
 	def foo(self):
 		return self.__certs.values()
 
 
 
+## There can be millions of records, ports and zone domains in a model, so
+## they have slots instead of a __dict__.
 class Record:
+	__slots__ = ('__port', '__cert', '__ttl', '__usage', '__selector', '__type', '__cname', '__rdata', '__record', '__add', '__delete', '__deleteAll')
+	
 	@sir.util.classproperty
 	def DEFAULT_TTL():
 		return 3600
@@ -372,56 +547,78 @@ class Record:
 	def type(self):
 		return self.__type
 	
+	## Whether the record should be published in the SharedRrset of its cert
+	@property
+	def cname(self):
+		return self.__cname
+	
+	## Only built again, when the hash of the cert changed. The values rendered
+	## from it (record, add and delete) are built again with it.
 	@property
 	def rdata(self):
+		hash = self.__cert.getHash(self.__selector, self.__type, self.__usage)
+		if self.__rdata is None or self.__rdata.data != hash:
+			self.__rdata  = sir.dns.Tlsa(self.__usage.value, self.__selector.value, self.__type.value, hash)
+			self.__record = None
+			self.__add    = None
+			self.__delete = None
+		
 		return self.__rdata
 	
 	@property
 	def name(self):
-		if self.__port.port == ZoneDomain.WILDCARD:
-			port = '*'
-		else:
-			port = '_%s' % port
-		
-		return '%s._tcp.%s' % (
-			port,
-			self.__port.zoneDomain.domain.name,
-		)
+		return self.__port.recordName
 	
 	@property
 	def record(self):
-		return '%s %s TLSA %s %s %s %s' % (
-			self.name,
-			self.__ttl,
-			self.__usage.value,
-			self.__selector.value,
-			self.__type.value,
-			self.__cert.getHash(self.__selector, self.__type)
-		)
+		rdata = self.rdata
+		if self.__record is None:
+			self.__record = '%s %s TLSA %s' % (self.name, self.__ttl, rdata)
+		
+		return self.__record
 	
 	@property
 	def add(self):
-		return 'update add %s' % (self.record)
+		rdata = self.rdata
+		if self.__add is None:
+			self.__add = sir.dns.Change('add', self.name, sir.dns.Type.TLSA, self.__ttl, rdata)
+		
+		return self.__add
 	
 	@property
 	def delete(self):
-		return 'update delete %s' % (self.record)
+		rdata = self.rdata
+		if self.__delete is None:
+			self.__delete = sir.dns.Change('delete', self.name, sir.dns.Type.TLSA, self.__ttl, rdata)
+		
+		return self.__delete
 	
 	@property
 	def deleteAll(self):
-		return 'update delete %s TLSA' % (self.name)
+		if self.__deleteAll is None:
+			self.__deleteAll = sir.dns.Change('deleteAll', self.name, sir.dns.Type.TLSA)
+		
+		return self.__deleteAll
 	
-	def __init__(self, port, cert, ttl = DEFAULT_TTL(), usage = DEFAULT_USAGE(), selector = DEFAULT_SELECTOR(), type = DEFAULT_TYPE()):
-		self.__port     = port
-		self.__cert     = cert
-		self.__ttl      = ttl
-		self.__usage    = usage
-		self.__selector = selector
-		self.__type     = type
+	def __init__(self, port, cert, ttl = DEFAULT_TTL(), usage = DEFAULT_USAGE(), selector = DEFAULT_SELECTOR(), type = DEFAULT_TYPE(), cname = False):
+		self.__port      = port
+		self.__cert      = cert
+		self.__ttl       = ttl
+		self.__usage     = usage
+		self.__selector  = selector
+		self.__type      = type
+		self.__cname     = cname
+		self.__rdata     = None
+		self.__record    = None
+		self.__add       = None
+		self.__delete    = None
+		self.__deleteAll = None
 
 
 
 class Port:
+	__slots__ = ('__zoneDomain', '__port', '__records', '__recordName')
+	
 	@property
 	def zoneDomain(self):
 		return self.__zoneDomain
@@ -430,30 +627,103 @@ class Port:
 	def port(self):
 		return self.__port
 	
+	## A port has records of only a few certs (usually one, two during a
+	## rollover), so they are kept in a tuple, which is a lot smaller than a dict.
 	@property
 	def records(self):
-		return self.__records.values()
+		return self.__records
+	
+	## The name of the records, built on first use and shared by all of them
+	@property
+	def recordName(self):
+		if self.__recordName is None:
+			self.__recordName = '%s._tcp.%s' % (
+				'*' if self.__port == ZoneDomain.WILDCARD else '_%s' % self.__port,
+				self.__zoneDomain.domain.name,
+			)
+		
+		return self.__recordName
+	
+	## The SharedRrset this name is a CNAME of or None. Only a name with the
+	## record of a single cert can be a CNAME.
+	@property
+	def sharedRrset(self):
+		if len(self.__records) == 1 and self.__records[0].cname:
+			return self.__zoneDomain.zone.sharedRrset(self.__records[0].cert)
+		
+		return None
 	
 	def __init__(self, zoneDomain, port):
 		self.__zoneDomain = zoneDomain
 		self.__port = port
-		self.__records = {}
+		self.__records = ()
+		self.__recordName = None
 	
 	## Here we break with get...() and autocreation of sub-items.
 	def createRecord(self, cert, *args, **kwargs):
-		if cert in self.__records:
+		if any(record.cert is cert for record in self.__records):
 			raise Exception('%s has already a record for %s' % (str(self), cert.name))
 		
 		if self.__zoneDomain.domain not in cert.domains:
 			raise Exception('You can\'t add %s to %s, hence it\'s domain (%s) is not in the cert' % (str(cert), str(self), self.__zoneDomain.domain))
 		
 		record = Record(self, cert, *args, **kwargs)
-		self.__records[cert] = record
+		self.__records += (record,)
+		self.__zoneDomain.zone.addCert(cert)
+		
+		if record.cname:
+			self.__zoneDomain.zone.share(record)
+		
 		return record
 
 
 
+## The TLSA RRset of a cert in a zone, which the names of its records with
+## cname point to (RFC 7671, section 7). A rollover only has to update this
+## RRset instead of every name. It looks like a Port with a single record to the
+## updates.
+class SharedRrset:
+	__slots__ = ('__zone', '__records')
+	
+	@property
+	def zone(self):
+		return self.__zone
+	
+	@property
+	def records(self):
+		return self.__records
+	
+	@property
+	def recordName(self):
+		return '_cert-%s._tlsa.%s' % (self.__records[0].cert.name, self.__zone.zone)
+	
+	## It's not a CNAME itself
+	@property
+	def sharedRrset(self):
+		return None
+	
+	## The RRset has a single record, so every record sharing it needs the same
+	## parameters as this one.
+	def __init__(self, zone, record):
+		if re.fullmatch(r'[A-Za-z0-9_-]{1,57}', record.cert.name) is None:
+			raise Exception('The name of %s can\'t be used in a DNS name, so its records can\'t have cname' % record.cert)
+		
+		self.__zone    = zone
+		self.__records = (Record(self, record.cert, record.ttl, record.usage, record.selector, record.type),)
+	
+	def __str__(self):
+		return 'Shared TLSA RRset of %s in %s' % (self.__records[0].cert, self.__zone)
+	
+	def check(self, record):
+		shared = self.__records[0]
+		if (record.ttl, record.usage, record.selector, record.type) != (shared.ttl, shared.usage, shared.selector, shared.type):
+			raise Exception('All records of %s with cname in %s need the same ttl, usage, selector and type' % (record.cert, self.__zone))
+
+
+
 class ZoneDomain:
+	__slots__ = ('__zone', '__domain', '__ports')
+	
 	@sir.util.classproperty
 	def WILDCARD():
 		return 'wildcard'
@@ -534,16 +804,46 @@ class Zone:
 	def zoneDomains(self):
 		return self.__zoneDomains.values()
 	
+	## The certs with records in this zone
+	@property
+	def certs(self):
+		return self.__certs.keys()
+	
 	def __init__(self, name, keyFile = DEFAULT_KEY_FILE(), server = DEFAULT_SERVER(), port = DEFAULT_PORT()):
 		self.__zone        = name
 		self.__keyFile     = keyFile
 		self.__server      = server
 		self.__port        = port
 		self.__zoneDomains = {}
+		self.__certs       = {}
+		self.__shared      = {}
+	
+	def __str__(self):
+		return 'Zone %s' % self.__zone
+	
+	def addCert(self, cert):
+		self.__certs[cert] = None
+	
+	## Adds record to the SharedRrset of its cert
+	def share(self, record):
+		if record.cert in self.__shared:
+			self.__shared[record.cert].check(record)
+		else:
+			self.__shared[record.cert] = SharedRrset(self, record)
+	
+	def sharedRrset(self, cert):
+		return self.__shared[cert]
+	
+	## Whether name is the zone itself or below it (a plain endswith() would
+	## also accept badexample.com for example.com)
+	def contains(self, name):
+		name = name.rstrip('.').lower()
+		zone = self.__zone.rstrip('.').lower()
+		return name == zone or name.endswith('.' + zone) or zone == ''
 	
 	def getZoneDomainOfDomain(self, domain):
 		if not domain.name in self.__zoneDomains:
-			if not domain.name.endswith(self.__zone):
+			if not self.contains(domain.name):
 				raise Exception('Domain %s is not part of %s, therfore your can\'t add it.' % (str(self), domain.name))
 			
 			self.__zoneDomains[domain.name] = ZoneDomain(self, domain)
@@ -552,18 +852,87 @@ class Zone:
 
 
 
+## Longest suffix matches of names on labels. The labels of the keys are
+## stored reversed in nested dicts (com -> example -> www), so a lookup takes as
+## many steps as the name has labels, no matter how many keys there are.
+class LabelTrie:
+	def __init__(self):
+		self.__root = {}
+	
+	
+	@staticmethod
+	def labels(name):
+		name = name.rstrip('.').lower()
+		return reversed(name.split('.')) if name else []
+	
+	
+	def add(self, name, value):
+		node = self.__root
+		for label in LabelTrie.labels(name):
+			node = node.setdefault(label, {})
+		
+		## None can't be a label
+		node[None] = value
+	
+	
+	## The value of the longest key, which is name or a parent of it (or None)
+	def longest(self, name):
+		node  = self.__root
+		value = node.get(None)
+		for label in LabelTrie.labels(name):
+			node = node.get(label)
+			if node is None:
+				break
+			
+			value = node.get(None, value)
+		
+		return value
+
+
+
+## There can be several zones with the same name (e.g. on different servers),
+## so the indexes by name and server map to lists.
 class ZoneSet:
-	__zones = {}
+	def __init__(self):
+		self.__zones    = {}
+		self.__byName   = {}
+		self.__byServer = {}
+		self.__trie     = LabelTrie()
 	
 	
 	def get(self, name, keyFile = Zone.DEFAULT_KEY_FILE, server = Zone.DEFAULT_SERVER, port = Zone.DEFAULT_PORT):
 		key = (name, keyFile, server, port)
 		
 		if not key in self.__zones:
-			self.__zones[key] = Zone(*key)
+			zone = Zone(*key)
+			self.__zones[key] = zone
+			self.__byServer.setdefault(server, []).append(zone)
+			
+			if name not in self.__byName:
+				self.__byName[name] = []
+				self.__trie.add(name, self.__byName[name])
+			self.__byName[name].append(zone)
 		
 		return self.__zones[key]
 	
 	
+	## The zones, which domain is in: The ones with the name of the most
+	## specific zone containing it (there might be several on different
+	## servers).
+	def zonesOf(self, domain):
+		return list(sir.util.noNone(self.__trie.longest(domain.name), []))
+	
+	
+	## The zones with a name matching one of the name patterns and a server
+	## matching one of the server patterns (None matches everything)
+	def find(self, names = None, servers = None):
+		zones = set(self.__zones.values())
+		for index, patterns in [(self.__byName, names), (self.__byServer, servers)]:
+			if patterns is not None:
+				zones &= {zone for matching in sir.util.globLookup(index, patterns) for zone in matching}
+		
+		return list(zones)
+	
+	
 	def keys(self):
 		return self.__zones.values()
\ No newline at end of file
@@ -17,139 +17,449 @@
 # along with Sir.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import collections
+import datetime
+import importlib
 import logging
-import operator
+import os
 import shlex
+import time
 import sir.config
+import sir.configcache
+import sir.fingerprint
+import sir.hashcache
+import sir.metrics
 import sir.model
+import sir.state
+import sir.update
 import sir.util
+import sir.verify
+
+
+
+## The outcome of one (sub) step: The items (as strings), which were done and
+## {item: error message} of the failed ones.
+StepResult = collections.namedtuple('StepResult', ['step', 'done', 'failed'])
 
 
 
 class Sir:
 	def __init__(self):
-		self.__certs   = sir.model.CertSet()
-		self.__domains = sir.model.DomainSet()
-		self.__zones   = sir.model.ZoneSet()
+		self.__certs         = sir.model.CertSet()
+		self.__domains       = sir.model.DomainSet()
+		self.__zones         = sir.model.ZoneSet()
+		self.__jobs          = os.cpu_count() or 1
+		self.__signJobs      = 4
+		self.__dnsJobs       = 4
+		self.__dnsBackend    = 'nsupdate'
+		self.__diff          = False
+		self.__maxUpdateSize = sir.update.DEFAULT_MAX_SIZE
+		self.__state         = sir.state.State()
+		self.__force         = False
+		self.__margin        = sir.util.parseDuration(sir.verify.DEFAULT_MARGIN)
+		self.__verifyTimeout = sir.util.parseDuration(sir.verify.DEFAULT_TIMEOUT)
+		self.__selection     = None
+		self.__fresh         = False
+		self.__results       = []
+		self.__metrics       = sir.metrics.Metrics()
+		self.__metricsFile   = None
 		
 		self.__steps = {
 			'key': {
-				'fn'  : self.__stepCreateKeyAndCsr,
-				'dsc' : 'Create private keys and associated csrs',
+				'fn'      : self.__stepCreateKeyAndCsr,
+				'dsc'     : 'Create private keys and associated csrs',
+				'modules' : ('sir.keygen',),
 			},
 			'cert': {
-				'fn'  : self.__stepCreateCertAndChain,
-				'dsc' : 'Call the sign script to create certs and chains',
+				'fn'      : self.__stepCreateCertAndChain,
+				'dsc'     : 'Call the sign script to create certs and chains',
+				'modules' : (),
 			},
 			'addtlsa': {
-				'fn'  : self.__stepAddTlsa,
-				'dsc' : 'Add TLSA records for the new certs',
+				'fn'      : self.__stepAddTlsa,
+				'dsc'     : 'Add TLSA records for the new certs',
+				'modules' : (),
+			},
+			'verifytlsa': {
+				'fn'      : self.__stepVerifyTlsa,
+				'dsc'     : 'Wait until the new TLSA records are on all authoritative servers and the old ones expired',
+				'modules' : (),
 			},
 			'rollover': {
-				'fn'  : self.__stepRollover,
-				'dsc' : 'Call your roll-over scripts to install the new certs',
+				'fn'      : self.__stepRollover,
+				'dsc'     : 'Call your roll-over scripts to install the new certs',
+				'modules' : (),
 			},
 			'updatetlsa': {
-				'fn'  : self.__stepUpdateTlsa,
-				'dsc' : 'Delete all TLSA records an add only the new ones',
+				'fn'      : self.__stepUpdateTlsa,
+				'dsc'     : 'Delete all TLSA records an add only the new ones',
+				'modules' : (),
 			},
 			'phase1': {
-				'fn'  : self.__stepPhase1,
-				'dsc' : 'Do the key, cert and addtlsa steps',
+				'fn'      : self.__stepPhase1,
+				'dsc'     : 'Do the key, cert and addtlsa steps',
+				'modules' : ('sir.keygen',),
 			},
 			'phase2': {
-				'fn'  : self.__stepPhase2,
-				'dsc' : 'Do the rollover and updatetlsa steps',
+				'fn'      : self.__stepPhase2,
+				'dsc'     : 'Do the verifytlsa, rollover and updatetlsa steps',
+				'modules' : (),
 			},
 			'full': {
-				'fn'  : self.__stepFull,
-				'dsc' : 'Do all steps',
+				'fn'      : self.__stepFull,
+				'dsc'     : 'Do all steps',
+				'modules' : ('sir.keygen',),
+			},
+			'daemon': {
+				'fn'      : self.__stepDaemon,
+				'dsc'     : 'Keep running and do every step of every cert when it is due (replaces the cron jobs)',
+				'modules' : ('sir.keygen', 'sir.daemon'),
+			},
+			'prunecache': {
+				'fn'      : self.__stepPruneCache,
+				'dsc'     : 'Remove hash cache entries of certs, which don\'t exist any more',
+				'modules' : (),
 			},
 		}
 		
 		
 	
 	
-	def __nsupdate(self, onRecord = None, onName = None):
-		## Iterate over key files
-		for keyFile, keyFileZones in sir.util.groupBy(self.__zones.keys(), lambda z: sir.util.noNone(z.keyFile)):
-			script = ''
-			
-			## Iterate over server using a keyfile
-			for connection, serverZones in sir.util.groupBy(keyFileZones, lambda z: z.connection):
-				script += 'server %s %s\n' % connection
-				
-				## Iterate over zones on a server
-				for zone in serverZones:
-					script += 'zone %s.\n' % zone.zone
-					
-					## Iterate over names in a zone
-					for domain in zone.zoneDomains:
-						if not onName is None:
-							script += '%s\n' % onName(list(list(domain.ports)[0].records)[0])
-						
-						## Iterate over records (of different certs) for a name
-						for port in domain.ports:
-							for record in port.records:
-								if not onRecord is None:
-									script += '%s\n' % onRecord(record)
-					
-					script += 'send\n'
-			
-			args = ['nsupdate']
-			if keyFile != '':
-				args.extend(['-k', keyFile])
-			
-			print(sir.util.sh(args, script.encode('UTF-8')))
+	## The StepResult of every step summarized so far
+	@property
+	def results(self):
+		return self.__results
+	
+	
+	## Sends one batch of updates per key file and server. Batches for different
+	## servers are independent and run in parallel, but the zones of one server
+	## are still updated one after another. Only names with records of certs
+	## are updated. Returns the results of the batches and of the certs, which
+	## couldn't be hashed.
+	def __nsupdate(self, replace, certs):
+		certs = set(certs)
+		records = [
+			record
+			for zone in self.__zones.keys()
+			for port in sir.update.ports(zone, certs)
+			for record in port.records
+		]
+		
+		## Hash every cert once, before the batches need them. The certs, which
+		## can't be hashed (e.g. a broken cert file), are left out, so the others
+		## are still updated.
+		failed = [(cert, result, e) for cert, result, e in sir.fingerprint.precompute(records, self.__jobs) if e is not None]
+		certs -= {cert for cert, result, e in failed}
+		
+		batches = sir.update.batches(self.__zones.keys(), replace, certs)
+		return failed + sir.util.runParallel(lambda batch: batch.send(self.__dnsBackend, self.__diff, self.__maxUpdateSize), batches, self.__dnsJobs)
+	
+	
+	## The certs matching the filters, each given as None or a list of glob
+	## patterns. A cert has to match every given filter: Its name (certs), one
+	## of its domains (domains) or the zone or server of one of its records
+	## (zones, servers). Every filter is resolved through the indexes of the
+	## sets, so only the matching certs are looked at. Returns None without
+	## filters (every cert is selected).
+	def __select(self, certs, domains, zones, servers):
+		found = []
+		
+		if certs is not None:
+			found.append(set(self.__certs.find(certs)))
+		
+		if domains is not None:
+			found.append({cert for domain in self.__domains.find(domains) for cert in domain.certs})
+		
+		if zones is not None or servers is not None:
+			found.append({cert for zone in self.__zones.find(zones, servers) for cert in zone.certs})
+		
+		if not found:
+			return None
+		
+		## Not an error, e.g. a cron job for a server, whose zones moved elsewhere,
+		## just has nothing to do. But the filter might have a typo.
+		selected = set.intersection(*found)
+		if not selected:
+			logging.warning('No cert matches the filters, nothing to do')
+		
+		return sorted(selected, key = str)
+	
+	
+	## The certs selected by the filters (all, if there are none)
+	def __selected(self):
+		return self.__certs.foo() if self.__selection is None else self.__selection
+	
+	
+	## The certs (of the selected certs, if None), which are due for step (see
+	## Cert.isDue()). With --force every cert is due. The first step of a run
+	## also does the certs without any recorded progress (see fresh), the
+	## following ones find the progress recorded by it.
+	def __dueCerts(self, step, certs = None):
+		fresh        = self.__fresh
+		self.__fresh = False
+		
+		certs = list(self.__selected() if certs is None else certs)
+		due   = certs if self.__force else [cert for cert in certs if cert.isDue(step, self.__state, fresh = fresh)]
+		
+		sir.util.output('%s: %d certs due, %d skipped' % (step, len(due), len(certs) - len(due)))
+		return due
+	
+	
+	## Records step as done for the certs in the state, so a rerun continues
+	## with the unfinished certs and the following steps know what is due.
+	def __finish(self, step, certs):
+		for cert in certs:
+			self.__state.finish(cert, step, sir.state.fileDigest(cert.csrFile if step == 'key' else cert.certFile))
+	
+	
+	## A TLSA step is done for a cert, if it could be hashed and no batch with
+	## records of it failed (see __nsupdate()).
+	def __finishTlsa(self, step, certs, results):
+		failed = set().union(*({item} if isinstance(item, sir.model.Cert) else item.certs for item, result, e in results if e is not None))
+		self.__finish(step, [cert for cert in certs if cert not in failed])
+	
+	
+	## Prints a summary of runParallel() results ordered by name, so the output
+	## of two runs can be compared, and records it in results. Raises, if at
+	## least one item failed.
+	def __summarize(self, step, results):
+		failed = sorted(str(item) for item, result, e in results if e is not None)
+		
+		self.__results.append(StepResult(
+			step,
+			sorted(str(item) for item, result, e in results if e is None),
+			{str(item): str(e) for item, result, e in results if e is not None},
+		))
+		
+		sir.metrics.add('sir_step_items_total', len(results) - len(failed), step = step, result = 'done')
+		sir.metrics.add('sir_step_items_total', len(failed), step = step, result = 'failed')
+		
+		sir.util.output('%s: %d done, %d failed' % (step, len(results) - len(failed), len(failed)))
+		for item in failed:
+			sir.util.output(' * %s' % item)
+		
+		if failed:
+			raise Exception('Step %s failed for %d of %d items' % (step, len(failed), len(results)))
 	
 	
 	## Step 1.1 (create certs)
-	def __stepCreateKeyAndCsr(self):
-		for cert in self.__certs.foo():
-			cert.createKeyAndCsr()
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'key')
+	def __stepCreateKeyAndCsr(self, certs = None):
+		def create(cert):
+			with sir.metrics.timer('sir_cert_duration_seconds', cert = cert.name, action = 'key'):
+				cert.createKeyAndCsr()
+		
+		results = sir.util.runParallel(create, self.__dueCerts('key', certs), self.__jobs)
+		self.__finish('key', [cert for cert, result, e in results if e is None])
+		self.__summarize('key', results)
 	
 	
 	## Step 1.2 (sign certs)
-	def __stepCreateCertAndChain(self):
-		for cert in self.__certs.foo():
-			cert.createCertAndChain()
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'cert')
+	def __stepCreateCertAndChain(self, certs = None):
+		## One limiter per sign script (i.e. per CA). If certs using the same
+		## script disagree on the limits, the strictest one wins.
+		certs  = self.__dueCerts('cert', certs)
+		limits = {}
+		for cert in certs:
+			concurrency, rate = limits.get(cert.signScript, (None, None))
+			limits[cert.signScript] = (
+				min(filter(None, [concurrency, cert.signConcurrency]), default = None),
+				min(filter(None, [rate, cert.signRate]), default = None),
+			)
+		
+		limiters = {script: sir.util.Limiter(*limit) for script, limit in limits.items()}
+		
+		## The time waiting for the limiter isn't the one of the cert
+		def sign(cert):
+			with limiters[cert.signScript], sir.metrics.timer('sir_cert_duration_seconds', cert = cert.name, action = 'sign'):
+				cert.createCertAndChain()
+		
+		results = sir.util.runParallel(sign, certs, self.__signJobs)
+		self.__finish('cert', [cert for cert, result, e in results if e is None])
+		self.__summarize('cert', results)
 	
 	
 	## Step 1.3 (*Add* new TLSA records)
-	def __stepAddTlsa(self):
-		self.__nsupdate(operator.attrgetter('add'))
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'addtlsa')
+	def __stepAddTlsa(self, certs = None):
+		certs   = self.__dueCerts('addtlsa', certs)
+		results = self.__nsupdate(False, certs)
+		self.__finishTlsa('addtlsa', certs, results)
+		self.__summarize('addtlsa', results)
+	
+	
+	## Step 2.1 (Check, that the new TLSA records are everywhere). A cert, whose
+	## records are served by every authoritative server, is recorded as safe to
+	## roll over after the TTL of its RRsets (plus margin) counted from when
+	## they were published (see __published()). Certs with missing records are
+	## checked again, until the timeout is reached. Unless wait is unset, this
+	## step returns only after the rollover is safe.
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'verifytlsa')
+	def __stepVerifyTlsa(self, certs = None, wait = True):
+		certs    = self.__dueCerts('verifytlsa', certs)
+		pending  = set(certs)
+		missing  = {}
+		deadline = time.monotonic() + self.__verifyTimeout.total_seconds()
+		
+		while pending:
+			for cert, (certMissing, ttl) in sir.verify.verify(self.__zones.keys(), pending, self.__dnsJobs).items():
+				if certMissing:
+					missing[cert] = certMissing
+					continue
+				
+				digest = sir.state.fileDigest(cert.certFile)
+				at     = self.__published(cert, digest) + ttl + self.__margin.total_seconds()
+				self.__state.finish(cert, 'verifytlsa', digest, at)
+				sir.util.output('%s: TLSA records are on all servers, rollover is safe at %s' % (cert, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(at))))
+				pending.discard(cert)
+			
+			if not pending or time.monotonic() + sir.verify.POLL_INTERVAL > deadline:
+				break
+			
+			time.sleep(sir.verify.POLL_INTERVAL)
+		
+		for cert in sorted(pending, key = str):
+			logging.error('%s is missing TLSA records: %s', cert, ', '.join(missing[cert]))
+		
+		if wait:
+			self.__waitForRollover(set(certs) - pending)
+		
+		self.__summarize('verifytlsa', [(cert, None, Exception('Missing TLSA records') if cert in pending else None) for cert in certs])
+	
+	
+	## The time the TLSA records of the cert with digest were published by
+	## addtlsa, so rerunning verifytlsa doesn't delay the rollover again. If
+	## addtlsa wasn't recorded for this cert (e.g. with --force), that's now.
+	def __published(self, cert, digest):
+		cycle, done = self.__state.progress(cert)
+		
+		if 'addtlsa' in done and done['addtlsa'][1] == digest:
+			return done['addtlsa'][0]
+		
+		return time.time()
 	
 	
-	## Step 2.1 (Rollover)
-	def __stepRollover(self):
+	## Writes the metrics of run (the step given on the command line, see
+	## --metrics) with the outcome of step, the end of the validity of every
+	## cert and the hits of the hash cache so far. Every sample is labeled with
+	## run, so the files of different runs never have the same series, which
+	## the node_exporter would reject. A metrics file, which can't be written,
+	## doesn't fail the step.
+	def __writeMetrics(self, run, step, success):
+		if self.__metricsFile is None:
+			return
+		
+		self.__metrics.set('sir_last_run_timestamp_seconds', time.time(), step = step)
+		self.__metrics.set('sir_last_run_success', success, step = step)
+		self.__metrics.set('sir_hash_cache_hits_total', self.__certs.hashCache.hits)
+		self.__metrics.set('sir_hash_cache_misses_total', self.__certs.hashCache.misses)
+		
 		for cert in self.__certs.foo():
-			cert.rollover()
+			try:
+				notAfter = cert.notAfter
+			except Exception as e:
+				logging.warning('Can\'t read the end of the validity of %s: %s', cert, e)
+				continue
+			
+			if notAfter is not None:
+				self.__metrics.set('sir_cert_not_after_timestamp_seconds', notAfter.timestamp(), cert = cert.name)
+		
+		fileName = self.__metricsFile.replace('{step}', run)
+		try:
+			self.__metrics.write(fileName, run = run)
+		except OSError as e:
+			logging.error('Can\'t write metrics to %s: %s', fileName, e)
+	
+	
+	## Waits until the rollover of the certs is safe
+	def __waitForRollover(self, certs):
+		at = max(filter(None, (cert.rolloverAt(self.__state) for cert in certs)), default = 0)
+		
+		if at > time.time():
+			sir.util.output('Waiting %d seconds for the old TLSA records to expire' % (at - time.time()))
+			time.sleep(at - time.time())
+	
+	
+	## Step 2.2 (Rollover). The rollover scripts are run one after another,
+	## since they might restart the same services.
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'rollover')
+	def __stepRollover(self, certs = None):
+		def rollover(cert):
+			with sir.metrics.timer('sir_cert_duration_seconds', cert = cert.name, action = 'rollover'):
+				cert.rollover()
+		
+		results = sir.util.runParallel(rollover, self.__dueCerts('rollover', certs), 1)
+		self.__finish('rollover', [cert for cert, result, e in results if e is None])
+		self.__summarize('rollover', results)
 	
 	
-	## Step 2.2 (*Remove* old TLSA records)
-	def __stepUpdateTlsa(self):
-		self.__nsupdate(operator.attrgetter('add'), operator.attrgetter('deleteAll'))
+	## Step 2.3 (*Remove* old TLSA records). A name is updated, if a record of
+	## one of the due certs is in it. The records of the other certs of such a
+	## name are added again.
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'updatetlsa')
+	def __stepUpdateTlsa(self, certs = None):
+		certs   = self.__dueCerts('updatetlsa', certs)
+		results = self.__nsupdate(True, certs)
+		self.__finishTlsa('updatetlsa', certs, results)
+		self.__summarize('updatetlsa', results)
 	
 	
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'phase1')
 	def __stepPhase1(self):
 		self.__stepCreateKeyAndCsr()
 		self.__stepCreateCertAndChain()
 		self.__stepAddTlsa()
 	
 	
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'phase2')
 	def __stepPhase2(self):
+		self.__stepVerifyTlsa()
 		self.__stepRollover()
 		self.__stepUpdateTlsa()
 	
 	
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'full')
 	def __stepFull(self):
 		self.__stepPhase1()
 		self.__stepPhase2()
 	
 	
-	def main(self):
-		logging.basicConfig(level=logging.DEBUG)
+	## The daemon polls the servers for verifytlsa and waits for the rollover by
+	## itself. It starts every cycle with the key step, so it never does steps
+	## for certs without progress.
+	def __stepDaemon(self):
+		self.__verifyTimeout = datetime.timedelta(0)
+		self.__fresh         = False
+		
+		## The metrics are written after every step, not only when stopping
+		def runStep(step, certs):
+			success = False
+			try:
+				if step == 'verifytlsa':
+					self.__stepVerifyTlsa(certs, wait = False)
+				else:
+					self.__steps[step]['fn'](certs)
+				
+				success = True
+			
+			finally:
+				self.__writeMetrics('daemon', step, success)
 		
+		sir.daemon.Daemon(self.__selected(), self.__state, runStep).run()
+	
+	
+	## The hashes of trust anchor usages are cached under the chain file
+	@sir.metrics.timed('sir_step_duration_seconds', step = 'prunecache')
+	def __stepPruneCache(self):
+		cache = self.__certs.hashCache
+		removed = cache.prune({path for cert in self.__certs.foo() for path in (cert.certFile, cert.chainFile)})
+		sir.util.output('Removed %d entries from hash cache %s' % (removed, sir.util.noNone(cache.fileName, '(in memory)')))
+	
+	
+	## The command line options. sir.api takes the defaults of its options from
+	## here, too.
+	def parser(self):
 		stepDsc = ''
 		for key, i in self.__steps.items():
 			stepDsc += ' * %s: %s\n' % (key, i['dsc'])
@@ -192,6 +502,122 @@ The steps:
 			default = '/etc/sir/conf.yaml',
 		)
 		
+		parser.add_argument(
+			'-j', '--jobs',
+			help    = 'Number of keys and csrs to create in parallel (default: number of cores)',
+			type    = int,
+			default = os.cpu_count() or 1,
+		)
+		
+		parser.add_argument(
+			'--sign-jobs',
+			help    = 'Number of sign scripts to run in parallel (default: 4). See signConcurrency and signRate for per script limits',
+			type    = int,
+			default = 4,
+		)
+		
+		parser.add_argument(
+			'--dns-jobs',
+			help    = 'Number of DNS servers to update in parallel (default: 4)',
+			type    = int,
+			default = 4,
+		)
+		
+		parser.add_argument(
+			'--dns-backend',
+			help    = 'Send TLSA updates with the nsupdate binary or with the built in (native) client (default: nsupdate)',
+			choices = ['nsupdate', 'native'],
+			default = 'nsupdate',
+		)
+		
+		parser.add_argument(
+			'--diff',
+			help    = 'Query the current TLSA records first and only send the difference (skipping up to date servers)',
+			action  = 'store_true',
+		)
+		
+		parser.add_argument(
+			'--max-update-size',
+			help    = 'Split the updates of a zone into messages of at most this many bytes (default: %d)' % sir.update.DEFAULT_MAX_SIZE,
+			type    = int,
+			default = sir.update.DEFAULT_MAX_SIZE,
+		)
+		
+		parser.add_argument(
+			'--hash-cache',
+			help    = 'File to cache TLSA hashes across runs in, \'none\' to only cache in memory (default: %s)' % sir.hashcache.HashCache.DEFAULT_FILE,
+			default = sir.hashcache.HashCache.DEFAULT_FILE,
+		)
+		
+		parser.add_argument(
+			'--config-cache',
+			help    = 'Directory to cache the parsed config in, \'none\' to always parse it (default: $XDG_CACHE_HOME/sir or ~/.cache/sir)',
+			default = sir.configcache.ConfigCache.DEFAULT_DIR,
+		)
+		
+		parser.add_argument(
+			'--resolver',
+			help    = 'Resolver asked for the zones of domains with "zones: soa" as address[#port] (default: the first nameserver of /etc/resolv.conf)',
+		)
+		
+		parser.add_argument(
+			'--state',
+			help    = 'File to record the progress of every cert through the steps in, \'none\' to only keep it in memory (default: %s)' % sir.state.State.DEFAULT_FILE,
+			default = sir.state.State.DEFAULT_FILE,
+		)
+		
+		parser.add_argument(
+			'--metrics',
+			help    = 'File to write metrics (durations, failures, update sizes, cert expiry, ...) to after every step, in the format of the node_exporter textfile collector or as JSON, if it ends with .json. {step} is replaced by the step, so steps run by different users don\'t replace each other\'s metrics (default: none)',
+			default = 'none',
+		)
+		
+		parser.add_argument(
+			'--force',
+			help    = 'Do the step for every cert, even if it isn\'t due according to the state and renewBefore',
+			action  = 'store_true',
+		)
+		
+		parser.add_argument(
+			'--margin',
+			help    = 'Time to wait in addition to the TTL of the TLSA records, before a rollover is safe, e.g. 30s or 5m (default: %s)' % sir.verify.DEFAULT_MARGIN,
+			default = sir.verify.DEFAULT_MARGIN,
+		)
+		
+		parser.add_argument(
+			'--verify-timeout',
+			help    = 'Time verifytlsa waits for the TLSA records to show up on every authoritative server (default: %s)' % sir.verify.DEFAULT_TIMEOUT,
+			default = sir.verify.DEFAULT_TIMEOUT,
+		)
+		
+		parser.add_argument(
+			'--cert',
+			help    = 'Only handle certs with a name matching this glob pattern (can be given multiple times)',
+			metavar = 'PATTERN',
+			action  = 'append',
+		)
+		
+		parser.add_argument(
+			'--domain',
+			help    = 'Only handle certs with a domain matching this glob pattern (can be given multiple times)',
+			metavar = 'PATTERN',
+			action  = 'append',
+		)
+		
+		parser.add_argument(
+			'--zone',
+			help    = 'Only handle certs with records in a zone matching this glob pattern (can be given multiple times)',
+			metavar = 'PATTERN',
+			action  = 'append',
+		)
+		
+		parser.add_argument(
+			'--server',
+			help    = 'Only handle certs with records in a zone updated on a server matching this glob pattern (can be given multiple times)',
+			metavar = 'PATTERN',
+			action  = 'append',
+		)
+		
 		parser.add_argument(
 			'step',
 			metavar = 'STEP',
@@ -199,8 +625,71 @@ The steps:
 			help    = 'The step you would to take',
 		)
 		
-		args = parser.parse_args()
+		return parser
+	
+	
+	## Takes over the options (as parsed by parser()) and reads the config
+	def load(self, args):
+		self.__jobs          = args.jobs
+		self.__signJobs      = args.sign_jobs
+		self.__dnsJobs       = args.dns_jobs
+		self.__dnsBackend    = args.dns_backend
+		self.__diff          = args.diff
+		self.__maxUpdateSize = args.max_update_size
+		self.__state         = sir.state.State(None if args.state == 'none' else args.state)
+		self.__force         = args.force
+		self.__metricsFile   = None if args.metrics == 'none' else args.metrics
+		self.__margin        = sir.util.parseDuration(args.margin)
+		self.__verifyTimeout = sir.util.parseDuration(args.verify_timeout)
 		
+		if args.hash_cache != 'none':
+			self.__certs = sir.model.CertSet(sir.hashcache.HashCache(args.hash_cache))
+		
+		## Read config
+		cache    = sir.configcache.ConfigCache(args.config_cache) if args.config_cache != 'none' else None
+		resolver = None
+		if args.resolver is not None:
+			address, _, port = args.resolver.partition('#')
+			resolver = (address, int(port or 53))
+		
+		sir.config.ConfigParser(args.config, self.__certs, self.__domains, self.__zones, cache, self.__jobs, resolver)
+		
+		self.__selection = self.__select(args.cert, args.domain, args.zone, args.server)
+	
+	
+	## Modules, which are slow to import and only needed by some steps
+	## (cryptography for in process keys, asyncio for the daemon), are only
+	## loaded for them. The metrics of the step are written, even if it fails.
+	def step(self, step):
+		if step not in self.__steps:
+			raise Exception('Unknown step %s' % step)
+		
+		for module in self.__steps[step]['modules']:
+			importlib.import_module(module)
+		
+		token   = sir.metrics.CURRENT.set(self.__metrics)
+		success = False
+		
+		self.__fresh = True
+		try:
+			self.__steps[step]['fn']()
+			success = True
+		
+		finally:
+			self.__writeMetrics(step, step, success)
+			sir.metrics.CURRENT.reset(token)
+	
+	
+	## Closes the state and the hash cache
+	def close(self):
+		self.__state.close()
+		self.__certs.hashCache.close()
+	
+	
+	def main(self):
+		logging.basicConfig(level=logging.DEBUG)
+		
+		args = self.parser().parse_args()
 		
 		## Setup logging
 		if args.verbose == 0:
@@ -210,8 +699,5 @@ The steps:
 		elif args.verbose >= 2:
 			logging.root.level = logging.DEBUG
 		
-		## Read config
-		sir.config.ConfigParser(args.config, self.__certs, self.__domains, self.__zones)
-		
-		## Do step
-		self.__steps[args.step]['fn']()
+		self.load(args)
+		self.step(args.step)
@@ -0,0 +1,152 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import sir.util
+
+
+
+## The steps of a rollover in their order
+STEPS = ('key', 'cert', 'addtlsa', 'verifytlsa', 'rollover', 'updatetlsa')
+
+
+
+## SHA-256 of a file or None, if it doesn't exist
+def fileDigest(path):
+	with contextlib.suppress(FileNotFoundError):
+		return hashlib.sha256(sir.util.readFile(path, 'rb')).hexdigest()
+	
+	return None
+
+
+
+## The progress of every cert through the steps of its rollovers. Every key
+## step starts a new cycle, the following steps are recorded in the cycle of
+## their cert with the time they were finished and the digest of the artifact
+## they produced or acted on (the csr for key, the cert for all other steps).
+## verifytlsa is recorded with the time the rollover is safe, which might be in
+## the future. All cycles are kept as history.
+## 
+## The store is shared by all users running steps (instead of the directories
+## of every step before), so the file is created group writable. If it can't
+## be opened, the state is only kept in memory.
+class State:
+	@sir.util.classproperty
+	def DEFAULT_FILE():
+		return '/var/lib/sir/state/state.sqlite'
+	
+	@property
+	def fileName(self):
+		return self.__fileName
+	
+	## A file name of None keeps the state in memory only
+	def __init__(self, fileName = None):
+		self.__fileName = fileName
+		self.__lock     = threading.Lock()
+		self.__db       = None
+	
+	
+	## The database is opened on first use, so steps without certs don't need
+	## access to it.
+	def __open(self):
+		if self.__db is not None:
+			return
+		
+		try:
+			if self.__fileName is None:
+				self.__db = sqlite3.connect(':memory:', check_same_thread = False)
+			
+			else:
+				if not os.path.exists(self.__fileName):
+					fd = os.open(self.__fileName, os.O_WRONLY | os.O_CREAT, 0o660)
+					os.fchmod(fd, 0o660)
+					os.close(fd)
+				
+				self.__db = sqlite3.connect(self.__fileName, timeout = 60, check_same_thread = False)
+			
+			self.__createTable()
+		
+		except (OSError, sqlite3.Error) as e:
+			logging.warning('Can\'t use state %s (%s), the progress will only be kept in memory. Its directory has to be writable for the group sir (see README).', self.__fileName, e)
+			self.__fileName = None
+			self.__db = sqlite3.connect(':memory:', check_same_thread = False)
+			self.__createTable()
+	
+	
+	def __createTable(self):
+		with self.__db:
+			self.__db.execute('''
+				CREATE TABLE IF NOT EXISTS steps (
+					cert     TEXT    NOT NULL,
+					cycle    INTEGER NOT NULL,
+					step     TEXT    NOT NULL,
+					finished REAL    NOT NULL,
+					digest   TEXT,
+					PRIMARY KEY (cert, cycle, step)
+				)
+			''')
+	
+	
+	def __cycle(self, cert):
+		return self.__db.execute('SELECT MAX(cycle) FROM steps WHERE cert = ?', (cert.name,)).fetchone()[0]
+	
+	
+	## The current cycle of cert (None, if there never was a key step) and a
+	## dict of its finished steps with (time, digest).
+	def progress(self, cert):
+		with self.__lock:
+			self.__open()
+			cycle = self.__cycle(cert)
+			rows = self.__db.execute(
+				'SELECT step, finished, digest FROM steps WHERE cert = ? AND cycle = ?',
+				(cert.name, cycle),
+			)
+			
+			return (cycle, {step: (finished, digest) for step, finished, digest in rows})
+	
+	
+	## Records step as finished for cert at the given time (default: now). The
+	## key step starts a new cycle.
+	def finish(self, cert, step, digest = None, at = None):
+		if step not in STEPS:
+			raise Exception('Unknown step %s' % step)
+		
+		with self.__lock:
+			self.__open()
+			
+			with self.__db:
+				cycle = sir.util.noNone(self.__cycle(cert), 0)
+				if step == 'key':
+					cycle += 1
+				
+				self.__db.execute(
+					'INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?)',
+					(cert.name, cycle, step, sir.util.noNone(at, time.time()), digest),
+				)
+	
+	
+	def close(self):
+		if self.__db is not None:
+			self.__db.close()
+			self.__db = None
@@ -0,0 +1,343 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import time
+import sir.dns
+import sir.metrics
+import sir.util
+
+
+
+## Upper bound for messages sent over TCP is 65535 bytes, but not every server
+## likes big updates.
+DEFAULT_MAX_SIZE = 32768
+
+## Name of the key, the longest algorithm name and a SHA-512 MAC
+TSIG_SIZE = 256 + 26 + 16 + 64 + 6
+
+
+
+## All TLSA updates for the zones on one server using the same key file. If
+## replace is set, the TLSA RRsets are replaced by the records of the config,
+## otherwise these records are only added. If certs is given, only the names
+## with records of these certs are updated (see ports()).
+class Batch:
+	@property
+	def keyFile(self):
+		return self.__keyFile
+	
+	@property
+	def connection(self):
+		return self.__connection
+	
+	## The certs whose records are sent by this batch
+	@property
+	def certs(self):
+		return {
+			record.cert
+			for zone in self.__zones
+			for port in ports(zone, self.__certs)
+			for record in self.__records(port)
+		}
+	
+	def __init__(self, keyFile, connection, zones, replace, certs = None):
+		self.__keyFile    = keyFile
+		self.__connection = connection
+		self.__zones      = zones
+		self.__replace    = replace
+		self.__certs      = certs
+	
+	
+	def __str__(self):
+		server = 'Server %s port %s' % self.__connection
+		if self.__keyFile != '':
+			server += ' with key %s' % self.__keyFile
+		
+		return server
+	
+	
+	def __dns(self):
+		key = sir.dns.Key.fromFile(self.__keyFile) if self.__keyFile != '' else None
+		return sir.dns.Connection(*self.__connection, key = key)
+	
+	
+	## Replacing a RRset needs all records of the name, adding only the ones of
+	## the certs.
+	def __records(self, port):
+		if self.__replace or self.__certs is None:
+			return list(port.records)
+		else:
+			return [record for record in port.records if record.cert in self.__certs]
+	
+	
+	## The ports of zone to update, preceded by the SharedRrsets they are CNAMEs
+	## of, so a new CNAME never points to a missing RRset.
+	def __ports(self, zone):
+		selected = ports(zone, self.__certs)
+		shared   = dict.fromkeys(port.sharedRrset for port in selected if port.sharedRrset is not None)
+		return list(shared) + selected
+	
+	
+	## The changes of every name (port) of every zone. The changes of one name
+	## are kept in a list of their own. current has the state of the names read
+	## from the server, all of them with diff, otherwise only the ones with a
+	## record with cname (see send()).
+	def __changes(self, current):
+		zones = []
+		
+		for zone in self.__zones:
+			names = []
+			
+			for port in self.__ports(zone):
+				records = self.__records(port)
+				state   = current.get(port.recordName)
+				
+				## A name, which can't be shared (any more), might still be a
+				## CNAME. Without diff, this is only known for names with a
+				## record with cname.
+				cname = state is not None and state[2] is not None
+				
+				if port.sharedRrset is not None:
+					changes = share(records[0], port.sharedRrset, state, self.__replace)
+				
+				## The CNAME is replaced by all records of the name
+				elif cname:
+					changes = [sir.dns.Change('deleteAll', port.recordName, sir.dns.Type.CNAME)] + [record.add for record in port.records]
+					if self.__replace:
+						changes.insert(0, records[0].deleteAll)
+				
+				elif state is None:
+					changes = [record.add for record in records]
+					if self.__replace:
+						changes.insert(0, records[0].deleteAll)
+				
+				else:
+					changes = diff(records, state[0], state[1], self.__replace)
+				
+				names.append(changes)
+			
+			zones.append((zone.zone, names))
+		
+		return zones
+	
+	
+	## The names, whose state is read from the server before the update (see
+	## send())
+	def __queried(self, diff):
+		return [
+			port.recordName
+			for zone in self.__zones
+			for port in self.__ports(zone)
+			if diff or any(record.cname for record in port.records)
+		]
+	
+	
+	## Reads the current TLSA RRsets (and CNAMEs) of the names from the server.
+	def __current(self, dns, names):
+		if not names:
+			return {}
+		
+		return {
+			name: (ttl, {sir.dns.Tlsa.fromWire(rdata) for rdata in rdatas}, cname)
+			for name, (ttl, rdatas, cname) in dns.rrsets(names, sir.dns.Type.TLSA).items()
+		}
+	
+	
+	## Splits the names of every zone into update messages of at most maxSize
+	## bytes. The changes of one name always stay in the same message, so a name
+	## never loses its records in between two messages. Returns a list of
+	## (zone, changes, size) with one entry per message.
+	def __messages(self, zones, maxSize):
+		## Header, zone section and (if there is a key) the TSIG RR
+		overhead = 12 + 4 + (TSIG_SIZE if self.__keyFile != '' else 0)
+		
+		messages = []
+		for zone, names in zones:
+			empty = overhead + len(sir.dns.encodeName(zone))
+			changes, size = [], empty
+			
+			for nameChanges in names:
+				nameSize = sum(len(change.wire) for change in nameChanges)
+				
+				if changes and size + nameSize > maxSize:
+					messages.append((zone, changes, size))
+					changes, size = [], empty
+				
+				if empty + nameSize > maxSize:
+					logging.warning('Changes of %s in %s need %d bytes, which is more than the max. update size', nameChanges[0].name, zone, empty + nameSize)
+				
+				changes = changes + nameChanges
+				size += nameSize
+			
+			if changes or not names:
+				messages.append((zone, changes, size))
+		
+		return messages
+	
+	
+	## If diff is set, only the difference between the records on the server and
+	## the config is sent. A server without differences isn't updated at all.
+	## Without diff, the names with a record with cname are still read from the
+	## server, so the CNAMEs of shared RRsets are only sent once and every
+	## further update only touches the shared RRsets.
+	## The time, the size and failures of the update are recorded per server in
+	## the metrics.
+	def send(self, backend, diff = False, maxSize = DEFAULT_MAX_SIZE):
+		server, port = self.__connection
+		start = time.monotonic()
+		names = self.__queried(diff)
+		dns   = self.__dns() if names or backend == 'native' else None
+		
+		try:
+			zones = self.__changes(self.__current(dns, names))
+			
+			if diff:
+				zones = [(zone, names) for zone, names in zones if any(names)]
+				if not zones:
+					sir.util.output('%s is up to date' % self)
+					return
+			
+			messages = self.__messages(zones, maxSize)
+			sir.metrics.add('sir_update_messages_total', len(messages), server = server, port = port)
+			sir.metrics.add('sir_update_changes_total', sum(len(changes) for zone, changes, size in messages), server = server, port = port)
+			sir.metrics.add('sir_update_bytes_total', sum(size for zone, changes, size in messages), server = server, port = port)
+			
+			if backend == 'native':
+				self.__sendNative(dns, messages)
+			else:
+				self.__sendNsupdate(messages)
+			
+			sir.util.output('%s: Sent %d messages with %d bytes' % (self, len(messages), sum(size for zone, changes, size in messages)))
+		
+		except Exception:
+			sir.metrics.add('sir_update_failures_total', server = server, port = port)
+			raise
+		
+		finally:
+			if dns is not None:
+				dns.close()
+			
+			sir.metrics.observe('sir_update_duration_seconds', time.monotonic() - start, server = server, port = port)
+	
+	
+	## The nsupdate script, line by line
+	def __script(self, messages):
+		yield ('server %s %s\n' % self.__connection).encode('UTF-8')
+		
+		for zone, changes, size in messages:
+			yield ('zone %s.\n' % zone).encode('UTF-8')
+			for change in changes:
+				yield ('%s\n' % change).encode('UTF-8')
+			yield b'send\n'
+	
+	
+	## The script is streamed into nsupdate, while it is generated
+	def __sendNsupdate(self, messages):
+		args = ['nsupdate']
+		if self.__keyFile != '':
+			args.extend(['-k', self.__keyFile])
+		
+		sir.util.output(sir.util.sh(args, self.__script(messages)))
+	
+	
+	## Sends all messages over one TCP connection, without nsupdate.
+	def __sendNative(self, dns, messages):
+		failed = []
+		
+		for zone, changes, size in messages:
+			rcode = dns.update(zone, changes)
+			sir.util.output('Update of zone %s (%d changes) on %s port %s: %s' % (zone, len(changes), *self.__connection, rcode.name))
+			
+			if rcode != sir.dns.Rcode.NOERROR:
+				failed.append('%s (%s)' % (zone, rcode.name))
+		
+		if failed:
+			raise Exception('Update of zone %s failed' % ', '.join(failed))
+
+
+
+## The minimal changes turning the current TLSA RRset (ttl and set of rdata) of
+## a name into the records of the config. Without replace, records which are on
+## the server, but not in the config, are kept.
+def diff(records, ttl, current, replace):
+	wanted = {record.rdata: record for record in records}
+	
+	## The TTL is a property of the whole RRset, so a changed TTL means adding
+	## every record again.
+	if current and any(record.ttl != ttl for record in records):
+		changes = [record.add for record in records]
+	else:
+		changes = [record.add for rdata, record in wanted.items() if rdata not in current]
+	
+	if replace:
+		changes.extend(
+			sir.dns.Change('delete', records[0].name, sir.dns.Type.TLSA, ttl, rdata)
+			for rdata in sorted(current - wanted.keys())
+		)
+	
+	return changes
+
+
+
+## The changes turning the name of record into a CNAME of shared, given the
+## current state of the name ((ttl, set of rdata, cname) as read from the
+## server). A name, which already is the CNAME, isn't touched. An existing
+## TLSA RRset is only turned into a CNAME by replace, since the shared RRset
+## might not have the records of the old cert yet.
+def share(record, shared, current, replace):
+	target = sir.dns.Change('add', record.name, sir.dns.Type.CNAME, record.ttl, sir.dns.Cname(shared.recordName))
+	
+	ttl, rdatas, cname = current
+	if cname is not None and cname.rstrip('.').lower() == shared.recordName.rstrip('.').lower():
+		return []
+	
+	elif cname is not None or not rdatas:
+		return [target]
+	
+	elif replace:
+		return [record.deleteAll, target]
+	
+	else:
+		return diff([record], ttl, rdatas, False)
+
+
+
+## The ports (names) of a zone, which have records of one of the certs. All
+## ports, if certs is None.
+def ports(zone, certs = None):
+	return [
+		port
+		for domain in zone.zoneDomains
+		for port in domain.ports
+		if certs is None or any(record.cert in certs for record in port.records)
+	]
+
+
+
+## One batch per key file and server. With certs given, zones without records
+## of these certs are left out.
+def batches(zones, replace, certs = None):
+	if certs is not None:
+		zones = [zone for zone in zones if ports(zone, certs)]
+	
+	return [
+		Batch(keyFile, connection, list(serverZones), replace, certs)
+		for keyFile, keyFileZones in sir.util.groupBy(zones, lambda z: sir.util.noNone(z.keyFile))
+		for connection, serverZones in sir.util.groupBy(keyFileZones, lambda z: z.connection)
+	]
@@ -16,37 +16,140 @@
 # You should have received a copy of the GNU General Public License
 # along with Sir.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import concurrent.futures
+import contextvars
+import datetime
+import fnmatch
 import itertools
 import logging
 import shlex
 import subprocess
 import os
+import re
 import contextlib
+import threading
+import time
+import sir.metrics
 
 
 
-def readFile(filename):
-	with open(filename) as f:
+## Where messages for the user go (print by default). sir.api collects them per
+## run instead. It's a context variable, so concurrent runs (in threads) don't
+## mix up their messages.
+OUTPUT = contextvars.ContextVar('output', default = print)
+
+## Only the start of stdin is logged by sh(), as it can be huge (e.g. the
+## updates of a large zone)
+LOG_LIMIT = 4096
+
+## Stdin is written to the process in chunks of this size
+CHUNK_SIZE = 65536
+
+
+
+def output(message):
+	OUTPUT.get()(message)
+
+
+
+def readFile(filename, mode = 'r'):
+	with open(filename, mode) as f:
 		return f.read()
 
 
 
+## Creates the file with the given permissions (if it doesn't exist yet) and
+## writes data (bytes) to it.
+def writeFile(filename, data, mode = 0o644):
+	with open(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode), 'wb') as f:
+		f.write(data)
+
+
+
 def rmFile(filename):
 	with contextlib.suppress(FileNotFoundError):
 		os.remove(filename)
 
 
 
+## Runs args and returns its output. stdin can be bytes or an iterable of bytes
+## (e.g. a generator of lines), which is written to the process by another
+## thread while it runs, so it never has to be in memory as a whole. Its time
+## and failures are recorded per command in the metrics (see sir.metrics).
 def sh(args, stdin = None):
 	logging.info('Executing %s' % ' '.join(map(shlex.quote, args)))
-	try:
-		logging.debug('stdin:\n%s', stdin)
-		stdout = subprocess.check_output(args, input = stdin, stderr = subprocess.STDOUT).decode("UTF-8")[:-1]
-		logging.debug('stdout:\n%s', stdout)
-		return stdout
-	except subprocess.CalledProcessError as e:
-		logging.error('Failed executing %s, the output was:\n-----------\n%s\n-----------', ' '.join(map(shlex.quote, args)), e.output.decode("UTF-8"))
-		raise e
+	
+	start   = time.monotonic()
+	process = subprocess.Popen(args, stdin = None if stdin is None else subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+	size    = 0
+	head    = b''
+	error   = None
+	
+	## A process, which exited before reading all of stdin, breaks the pipe.
+	## Writing stops then and the return code decides, whether it failed.
+	def write(data):
+		try:
+			process.stdin.write(data)
+			return True
+		except BrokenPipeError:
+			return False
+	
+	def feed():
+		nonlocal size, head, error
+		
+		try:
+			chunk, chunkSize = [], 0
+			for data in [stdin] if isinstance(stdin, bytes) else stdin:
+				if size < LOG_LIMIT:
+					head += data[:LOG_LIMIT - size]
+				
+				size += len(data)
+				chunk.append(data)
+				chunkSize += len(data)
+				
+				if chunkSize >= CHUNK_SIZE:
+					if not write(b''.join(chunk)):
+						return
+					chunk, chunkSize = [], 0
+			
+			write(b''.join(chunk))
+		
+		## A script, which couldn't be generated completely, must not be run
+		except Exception as e:
+			process.kill()
+			error = e
+		
+		finally:
+			with contextlib.suppress(BrokenPipeError):
+				process.stdin.close()
+	
+	if stdin is not None:
+		writer = threading.Thread(target = feed)
+		writer.start()
+	
+	stdout = process.stdout.read().decode("UTF-8")
+	process.wait()
+	
+	if stdin is not None:
+		writer.join()
+		logging.debug('stdin (%d bytes%s):\n%s', size, ', cut' if size > LOG_LIMIT else '', head.decode('UTF-8', 'replace'))
+	
+	command = os.path.basename(args[0])
+	sir.metrics.observe('sir_command_duration_seconds', time.monotonic() - start, command = command)
+	if error is not None or process.returncode != 0:
+		sir.metrics.add('sir_command_failures_total', command = command)
+	
+	## The process was killed because of it
+	if error is not None:
+		raise error
+	
+	if process.returncode != 0:
+		logging.error('Failed executing %s, the output was:\n-----------\n%s\n-----------', ' '.join(map(shlex.quote, args)), stdout)
+		raise subprocess.CalledProcessError(process.returncode, args, stdout.encode('UTF-8'))
+	
+	logging.debug('stdout:\n%s', stdout[:-1])
+	return stdout[:-1]
 
 
 
@@ -58,11 +161,103 @@ def noNone(v, replacement = ''):
 
 
 
+## Parses a duration like '30d', '12h', '15m' or '90s' (a plain number means
+## seconds) into a timedelta. None stays None.
+def parseDuration(v):
+	if v is None or isinstance(v, datetime.timedelta):
+		return v
+	
+	units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+	
+	match = re.fullmatch(r'\s*(\d+)\s*([smhdw]?)\s*', str(v))
+	if match is None:
+		raise Exception('Invalid duration %s, expected e.g. 30d, 12h, 15m or 90s' % v)
+	
+	return datetime.timedelta(seconds = int(match.group(1)) * units[match.group(2) or 's'])
+
+
+
+## The values of index (a dict), whose keys match one of the glob patterns.
+## Patterns without wildcards are looked up directly, only the others have to
+## look at every key.
+def globLookup(index, patterns):
+	found = {}
+	for pattern in patterns:
+		if re.search(r'[*?[]', pattern) is None:
+			keys = [pattern] if pattern in index else []
+		else:
+			keys = fnmatch.filter(index, pattern)
+		
+		for key in keys:
+			found[key] = index[key]
+	
+	return list(found.values())
+
+
+
 def groupBy(l, f):
 	return itertools.groupby(sorted(l, key=f), f)
 
 
 
+## Calls fn for every item on a pool of jobs worker threads. The workers mostly
+## wait for forked processes, therefore threads are sufficient. An exception of
+## one call doesn't stop the others. Returns a list of (item, result, exception)
+## tuples in the order of items, no matter in which order the calls finished.
+## Every call runs in a copy of the context of the caller (see OUTPUT).
+def runParallel(fn, items, jobs = None):
+	items = list(items)
+	
+	def call(item):
+		try:
+			return (item, fn(item), None)
+		except Exception as e:
+			logging.error('%s failed: %s', item, e)
+			return (item, None, e)
+	
+	with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, jobs or os.cpu_count() or 1)) as pool:
+		return list(pool.map(lambda context, item: context.run(call, item), [contextvars.copy_context() for item in items], items))
+
+
+
+## Context manager limiting how many threads can be inside at the same time
+## (concurrency) and how often it can be entered per minute (perMinute). None
+## disables the limit.
+class Limiter:
+	def __init__(self, concurrency = None, perMinute = None):
+		self.__slots     = threading.BoundedSemaphore(concurrency) if concurrency else None
+		self.__perMinute = perMinute
+		self.__starts    = collections.deque()
+		self.__lock      = threading.Lock()
+	
+	
+	def __enter__(self):
+		if self.__slots is not None:
+			self.__slots.acquire()
+		
+		while self.__perMinute:
+			with self.__lock:
+				now = time.monotonic()
+				while self.__starts and self.__starts[0] <= now - 60:
+					self.__starts.popleft()
+				
+				if len(self.__starts) < self.__perMinute:
+					self.__starts.append(now)
+					break
+				
+				wait = self.__starts[0] + 60 - now
+			
+			time.sleep(wait)
+		
+		return self
+	
+	
+	def __exit__(self, *exc):
+		if self.__slots is not None:
+			self.__slots.release()
+
+
+
 ## http://stackoverflow.com/a/13624858
 class classproperty(object):
 	def __init__(self, fget):
@@ -0,0 +1,108 @@
+# Sir helps you to do automated TLS certificate rollovers, including TLSA updates.
+# Copyright (C) 2015  Skruppy <skruppy@onmars.eu>
+# 
+# This file is part of Sir.
+# 
+# Sir is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# Sir is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with Sir.  If not, see <http://www.gnu.org/licenses/>.
+
+## The gate between addtlsa and rollover: A cert may only be rolled over, once
+## its new TLSA records are served by every authoritative server of their zones
+## and the RRsets cached by resolvers before have expired.
+
+import socket
+import sir.dns
+import sir.update
+import sir.util
+
+
+
+## Time waited after the TTL of the RRsets, before a rollover is safe
+DEFAULT_MARGIN = '1m'
+
+## How long verifytlsa waits for the records to show up on every server
+DEFAULT_TIMEOUT = '10m'
+
+## Delay between two checks of the servers
+POLL_INTERVAL = 10
+
+
+
+## The servers, which are authoritative for zone, as a sorted list of (address,
+## port): The server updates are sent to and every NS of the zone.
+def servers(zone):
+	key = sir.dns.Key.fromFile(zone.keyFile) if zone.keyFile is not None else None
+	with sir.dns.Connection(*zone.connection, key = key) as dns:
+		response, = dns.query([zone.zone], sir.dns.Type.NS)
+	
+	if response.rcode != sir.dns.Rcode.NOERROR:
+		raise Exception('NS query for %s failed: %s' % (zone.zone, sir.dns.Rcode(response.rcode).name))
+	
+	addresses = {(address, zone.port) for address in resolve(zone.server, zone.port)}
+	for rr in response.rrset(zone.zone, sir.dns.Type.NS):
+		addresses.update((address, 53) for address in resolve(response.decodeName(rr)[0], 53))
+	
+	return sorted(addresses)
+
+
+
+def resolve(host, port):
+	return {info[4][0] for info in socket.getaddrinfo(host, port, type = socket.SOCK_STREAM)}
+
+
+
+## Checks on every authoritative server, whether the records of the certs in
+## the zones are served. Returns {cert: (missing, ttl)} for every cert with a
+## list of the servers and names missing records of the cert and the longest
+## TTL of its RRsets (which is the time resolvers might still use the old ones).
+## The records of a name with a CNAME are looked for at its target.
+def verify(zones, certs, jobs = None):
+	results = {cert: ([], 0) for cert in certs}
+	
+	records = {}
+	for zone in zones:
+		zoneRecords = [record for port in sir.update.ports(zone, certs) for record in port.records if record.cert in certs]
+		if zoneRecords:
+			records[zone] = zoneRecords
+	
+	def check(item):
+		zone, (address, port) = item
+		names = sorted({record.name for record in records[zone]})
+		with sir.dns.Connection(address, port) as dns:
+			rrsets = dns.rrsets(names, sir.dns.Type.TLSA)
+		
+		return {name: (ttl, {sir.dns.Tlsa.fromWire(rdata) for rdata in rdatas}) for name, (ttl, rdatas, cname) in rrsets.items()}
+	
+	items = []
+	for zone, found, e in sir.util.runParallel(servers, records, jobs):
+		if e is None:
+			items.extend((zone, server) for server in found)
+		else:
+			for record in records[zone]:
+				results[record.cert][0].append('NS of %s (%s)' % (zone.zone, e))
+	
+	for (zone, (address, port)), rrsets, e in sir.util.runParallel(check, items, jobs):
+		for record in records[zone]:
+			missing, ttl = results[record.cert]
+			
+			if e is not None:
+				missing.append('%s port %s (%s)' % (address, port, e))
+				continue
+			
+			rrsetTtl, rdatas = rrsets[record.name]
+			if record.rdata not in rdatas:
+				missing.append('%s on %s port %s' % (record.name, address, port))
+			
+			results[record.cert] = (missing, max(ttl, record.ttl, sir.util.noNone(rrsetTtl, 0)))
+	
+	return {cert: (sorted(set(missing)), ttl) for cert, (missing, ttl) in results.items()}